@@ -0,0 +1,258 @@
+"""音声の入出力バックエンド
+
+入力（録音）:
+    "sounddevice" : マイクなどの入力デバイス
+    "wav"         : WAV ファイル（実時間で流す / できるだけ速く流す）
+出力（再生）:
+    "sounddevice" : 出力デバイス（複数指定した場合は同時に再生する）
+    "wav"         : WAV ファイルへ書き出す
+    "null"        : 何もしない（サウンドデバイスのない環境や負荷試験用）
+
+設定は {"backend": 種類, ...} の辞書で指定する。例:
+    {"input": {"backend": "wav", "path": "test.wav", "realtime": false},
+     "outputs": [{"backend": "wav", "path": "out.wav"}, {"backend": "null"}]}
+
+sounddevice は使う時点で import するため、PortAudio がない環境でも
+ファイル・ヌルのバックエンドだけで動作する。
+"""
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+from audio_utils import to_float32
+
+
+# 入力
+class AudioInput:
+    """録音コールバック（sounddevice と同じ引数）に音声をブロック単位で渡す入力の基底クラス
+
+    ready は、次のブロックを渡してよいかを返す関数（録音スレッドから呼ばれる）。
+    実時間より速く流す入力は、ready() が偽の間は待つ（デバイスは待てないため無視する）。
+    realtime は、ブロックが録音された時刻どおりに渡されるか（偽の場合、渡した時刻は録音時刻として使えない）。
+    """
+
+    samplerate = None
+    realtime = True
+
+    @contextmanager
+    def open(self, callback, blocksize, ready=None):
+        raise NotImplementedError
+
+    async def wait(self):
+        """入力が終わるまで待つ（デバイスの場合は終わらない）"""
+        await asyncio.Event().wait()
+
+
+class SoundDeviceInput(AudioInput):
+    def __init__(self, device, samplerate, fallback_samplerate=None, channels=1):
+        import sounddevice as sd
+
+        self.sd = sd
+        self.device = device
+        self.channels = channels
+        # デバイスが samplerate で録音できなければ fallback_samplerate で録音する
+        try:
+            sd.check_input_settings(device=device, samplerate=samplerate, channels=channels, dtype="float32")
+            self.samplerate = samplerate
+        except Exception:
+            self.samplerate = fallback_samplerate or int(sd.query_devices(device)["default_samplerate"])
+
+    @contextmanager
+    def open(self, callback, blocksize, ready=None):
+        with self.sd.InputStream(
+            device=self.device,
+            samplerate=self.samplerate,
+            channels=self.channels,
+            callback=callback,
+            blocksize=blocksize,
+            dtype="float32",
+        ):
+            yield self
+
+
+class WavFileInput(AudioInput):
+    """WAV ファイルを録音の代わりに流す（別スレッドからコールバックを呼ぶ）
+
+    realtime=False の場合はできるだけ速く流す（ready() が偽の間は、処理が追いつくまで待つ）。
+    loop=True の場合は止めるまで繰り返す。
+    ファイルの末尾には発話終了を検出できるよう無音を付け足す。
+    """
+
+    def __init__(self, path, realtime=True, loop=False, trailing_silence=1.0):
+        self.path = Path(path)
+        self.realtime = realtime
+        self.loop = loop
+        self.trailing_silence = trailing_silence
+        self.samplerate = sf.info(self.path).samplerate
+        self._stop = threading.Event()
+        self._finished = threading.Event()
+
+    def _blocks(self, blocksize):
+        while True:
+            for block in sf.blocks(self.path, blocksize=blocksize, dtype="float32", always_2d=True):
+                yield block
+            silence = np.zeros((blocksize, 1), dtype=np.float32)
+            for _ in range(int(self.trailing_silence * self.samplerate / blocksize) + 1):
+                yield silence
+            if not self.loop:
+                return
+
+    def _run(self, callback, blocksize, ready):
+        next_time = time.perf_counter()
+        try:
+            for block in self._blocks(blocksize):
+                if not self.realtime and ready is not None:
+                    while not ready() and not self._stop.is_set():
+                        time.sleep(0.005)
+                if self._stop.is_set():
+                    break
+                callback(np.ascontiguousarray(block[:, :1]), len(block), None, None)
+                if self.realtime:
+                    # 締め切りを積み上げて、ブロックごとの誤差が溜まらないようにする
+                    next_time += len(block) / self.samplerate
+                    time.sleep(max(next_time - time.perf_counter(), 0))
+        finally:
+            self._finished.set()
+
+    @contextmanager
+    def open(self, callback, blocksize, ready=None):
+        thread = threading.Thread(target=self._run, args=(callback, blocksize, ready), name="wav-input", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            self._stop.set()
+            thread.join()
+
+    async def wait(self):
+        await asyncio.to_thread(self._finished.wait)
+
+
+# 出力
+class NullOutput:
+    """音声を捨てる出力。再生が呼ばれた時刻と再生時間だけを記録する
+
+    realtime=True の場合は、再生したのと同じだけ待ってから戻る。
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.play_times = []
+        self.played_duration = 0.0
+
+    async def play(self, audio, sr):
+        self.play_times.append(time.perf_counter())
+        self.played_duration += len(audio) / sr
+        if self.realtime:
+            await asyncio.sleep(len(audio) / sr)
+
+    async def interrupt(self, fade_duration):
+        return None
+
+    def close(self):
+        pass
+
+
+class WavFileOutput:
+    """再生する音声を順に WAV ファイルへ書き出す（最初のクリップのレートに揃える）"""
+
+    def __init__(self, path, samplerate=None, realtime=False):
+        self.path = Path(path)
+        self.samplerate = samplerate
+        self.realtime = realtime
+        self.file = None
+
+    async def play(self, audio, sr):
+        audio = to_float32(audio)
+        if self.file is None:
+            self.samplerate = self.samplerate or sr
+            self.file = sf.SoundFile(self.path, mode="w", samplerate=self.samplerate, channels=1)
+        if sr != self.samplerate:
+            audio = soxr.resample(audio, sr, self.samplerate)
+        self.file.write(audio)
+        if self.realtime:
+            await asyncio.sleep(len(audio) / self.samplerate)
+
+    async def interrupt(self, fade_duration):
+        # 書き出し済みの音声は取り消せない
+        return None
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class MultiOutput:
+    """複数の出力へ同時に再生し、すべて終わるまで待つ"""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    async def play(self, audio, sr):
+        await asyncio.gather(*(output.play(audio, sr) for output in self.outputs))
+
+    async def interrupt(self, fade_duration):
+        times = await asyncio.gather(*(output.interrupt(fade_duration) for output in self.outputs))
+        times = [t for t in times if t is not None]
+        return max(times) if times else None
+
+    def close(self):
+        for output in self.outputs:
+            output.close()
+
+
+# 設定
+def create_input(config, samplerate, fallback_samplerate=None, channels=1):
+    """設定から入力を作る（samplerate は希望するレートで、デバイスが対応していなければ fallback を使う）"""
+    backend = config.get("backend", "sounddevice")
+    if backend == "sounddevice":
+        return SoundDeviceInput(config.get("device"), samplerate, fallback_samplerate, channels)
+    if backend == "wav":
+        return WavFileInput(
+            config["path"],
+            realtime=config.get("realtime", True),
+            loop=config.get("loop", False),
+            trailing_silence=config.get("trailing_silence", 1.0),
+        )
+    raise ValueError(f"Unknown audio input backend: {backend}")
+
+
+def create_output(configs):
+    """設定のリストから出力を作る（sounddevice のデバイスはまとめて1つの AudioOutput にする）"""
+    devices = []
+    outputs = []
+    for config in configs:
+        backend = config.get("backend", "sounddevice")
+        if backend == "sounddevice":
+            devices.append(config.get("device"))
+        elif backend == "wav":
+            outputs.append(WavFileOutput(config["path"], config.get("samplerate"), config.get("realtime", False)))
+        elif backend == "null":
+            outputs.append(NullOutput(config.get("realtime", False)))
+        else:
+            raise ValueError(f"Unknown audio output backend: {backend}")
+    if devices:
+        from audio_output import AudioOutput
+
+        outputs.insert(0, AudioOutput(devices))
+    if len(outputs) == 1:
+        return outputs[0]
+    return MultiOutput(outputs)
+
+
+def load_audio_config(path, default_input, default_outputs):
+    """JSON の設定ファイルがあれば読み込み、(入力の設定, 出力の設定のリスト) を返す"""
+    if path is None or not Path(path).exists():
+        return default_input, default_outputs
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+    print(f"Audio backends loaded from {path}")
+    return config.get("input", default_input), config.get("outputs", default_outputs)
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+import sounddevice as sd
+import soxr
+
+from audio_utils import to_float32
+from metrics import Counter
+
+OUTPUT_UNDERFLOWS = Counter("output_underflows", "Output stream underflows reported by PortAudio", ("device",))
+
+
+class OutputDevice:
+    """1台の出力デバイスに開きっぱなしの OutputStream を持ち、クリップのキューから再生する
+
+    キューにはクリップの配列への参照だけを積む（複数デバイスで同じ配列を共有する）。
+    PortAudio のコールバックがキューから直接 outdata へ書き出し、再生し終えたクリップの
+    完了通知を呼ぶ。
+    """
+
+    def __init__(self, device, samplerate, latency="low"):
+        self.device = device
+        self.samplerate = samplerate
+        self.clips = deque()  # (audio, on_done)
+        self.current = None
+        self.current_done = None
+        self.offset = 0
+        self.interrupt_request = None  # (フェードのサンプル数, 無音になった時の通知)
+        self.stream = sd.OutputStream(
+            device=device,
+            samplerate=samplerate,
+            channels=1,
+            dtype="float32",
+            latency=latency,
+            callback=self._callback,
+        )
+
+    def start(self):
+        self.stream.start()
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+    def enqueue(self, audio, on_done):
+        """再生するクリップを追加する（audio は float32 の1次元配列で、書き換えないこと）"""
+        self.clips.append((audio, on_done))
+
+    def is_playing(self):
+        return self.current is not None or bool(self.clips)
+
+    def interrupt(self, fade_samples, on_silent):
+        """再生中のクリップをフェードアウトし、キューのクリップも含めて打ち切る
+
+        次のコールバックで処理し、無音になるまでの秒数（このブロックの先頭から）を on_silent に渡す。
+        """
+        self.interrupt_request = (fade_samples, on_silent)
+
+    def _fade_out(self, out, fade_samples, on_silent):
+        n = 0
+        if self.current is not None:
+            n = min(fade_samples, len(out), len(self.current) - self.offset)
+            out[:n] = self.current[self.offset:self.offset + n] * np.linspace(1, 0, n, dtype=np.float32)
+            self.current_done()
+            self.current = None
+        out[n:] = 0
+        while self.clips:
+            _, on_done = self.clips.popleft()
+            on_done()
+        on_silent(n / self.samplerate)
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status:
+            print(f"Output stream status ({self.device}): {status}")
+            if status.output_underflow:
+                OUTPUT_UNDERFLOWS.labels(self.device).inc()
+
+        out = outdata[:, 0]
+        request = self.interrupt_request
+        if request is not None:
+            self.interrupt_request = None
+            self._fade_out(out, *request)
+            return
+
+        filled = 0
+        while filled < frames:
+            if self.current is None:
+                if not self.clips:
+                    break
+                self.current, self.current_done = self.clips.popleft()
+                self.offset = 0
+            n = min(frames - filled, len(self.current) - self.offset)
+            out[filled:filled + n] = self.current[self.offset:self.offset + n]
+            filled += n
+            self.offset += n
+            if self.offset >= len(self.current):
+                self.current_done()
+                self.current = None
+        out[filled:] = 0
+
+
+def select_output_samplerate(device, samplerate):
+    """デバイスが合成音声のレートで開ければそのまま使い、開けなければデバイスの既定レートを使う"""
+    try:
+        sd.check_output_settings(device=device, samplerate=samplerate, channels=1, dtype="float32")
+        return samplerate
+    except Exception:
+        return int(sd.query_devices(device)["default_samplerate"])
+
+
+class AudioOutput:
+    """合成音声を複数の出力デバイスへ同時に再生する（デバイスごとに常駐ストリームを持つ）"""
+
+    def __init__(self, devices):
+        self.device_ids = devices
+        self.devices = []
+
+    def open(self, samplerate):
+        """合成音声のレートに合わせて各デバイスのストリームを開く"""
+        for device_id in self.device_ids:
+            device = OutputDevice(device_id, select_output_samplerate(device_id, samplerate))
+            device.start()
+            self.devices.append(device)
+            print(f"Output device {device_id} opened at {device.samplerate} Hz")
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+        self.devices = []
+
+    async def play(self, audio, sr):
+        """全デバイスで再生し、すべてのデバイスで再生し終わるまで待つ"""
+        if not self.devices:
+            self.open(sr)
+
+        loop = asyncio.get_running_loop()
+        audio = to_float32(audio)
+        # デバイスのレートごとに一度だけ変換し、同じレートのデバイス間では同じ配列を共有する
+        converted = {sr: audio}
+        futures = []
+        for device in self.devices:
+            if device.samplerate not in converted:
+                converted[device.samplerate] = soxr.resample(audio, sr, device.samplerate)
+            future = loop.create_future()
+            device.enqueue(
+                converted[device.samplerate],
+                lambda future=future: loop.call_soon_threadsafe(future.set_result, None),
+            )
+            futures.append(future)
+        await asyncio.gather(*futures)
+
+    async def interrupt(self, fade_duration):
+        """全デバイスの再生をフェードアウトして打ち切り、無音になった時刻（perf_counter）を返す
+
+        再生中でなければ何もせず None を返す。
+        """
+        playing = [device for device in self.devices if device.is_playing()]
+        if not playing:
+            return None
+        loop = asyncio.get_running_loop()
+        futures = []
+        for device in playing:
+            future = loop.create_future()
+
+            # 出力のレイテンシ分だけ遅れてスピーカーから音が消える
+            def on_silent(offset, future=future, device=device):
+                silent_at = time.perf_counter() + offset + device.stream.latency
+                loop.call_soon_threadsafe(future.set_result, silent_at)
+
+            device.interrupt(int(fade_duration * device.samplerate), on_silent)
+            futures.append(future)
+        return max(await asyncio.gather(*futures))
@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def to_float32(audio):
+    """int16 などの音声データを -1.0〜1.0 の float32 に変換する"""
+    if audio.dtype == np.float32:
+        return audio
+    if np.issubdtype(audio.dtype, np.integer):
+        return audio.astype(np.float32) / np.iinfo(audio.dtype).max
+    return audio.astype(np.float32)
+
+
+def fade_edges(audio, sr, duration=0.005):
+    """チャンクのつなぎ目でクリックノイズが出ないよう、先頭と末尾を短くフェードする"""
+    audio = to_float32(audio).copy()
+    n = min(int(sr * duration), len(audio) // 2)
+    if n > 0:
+        # 二乗余弦カーブで滑らかに立ち上げ・立ち下げる
+        ramp = (0.5 - 0.5 * np.cos(np.linspace(0, np.pi, n))).astype(np.float32)
+        audio[:n] *= ramp
+        audio[-n:] *= ramp[::-1]
+    return audio
+
+
+def split_at_quiet_points(audio, sr, ratios, search=0.2, frame=0.01):
+    """音声を ratios（0〜1 の累積比率）の位置付近で分割する
+
+    各分割位置は、推定位置の前後 search 秒のうち最も音量の小さいフレームへずらす。
+    """
+    frame_length = max(int(sr * frame), 1)
+    n_frames = len(audio) // frame_length
+    energy = np.square(audio[:n_frames * frame_length].astype(np.float32)).reshape(n_frames, frame_length).mean(axis=1)
+    radius = int(search / frame)
+    bounds = [0]
+    for ratio in ratios:
+        center = int(ratio * n_frames)
+        low = max(center - radius, bounds[-1] // frame_length + 1)
+        high = min(center + radius + 1, n_frames)
+        if low >= high:
+            bounds.append(min(max(center, low) * frame_length, len(audio)))
+            continue
+        bounds.append(int(low + np.argmin(energy[low:high])) * frame_length)
+    bounds.append(len(audio))
+    return [audio[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
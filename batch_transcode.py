@@ -0,0 +1,244 @@
+"""録音済みの音声ファイルをまとめて文字起こし・音声合成する
+
+    python batch_transcode.py recordings/ --output out/ --workers 2
+    python batch_transcode.py manifest.txt --output out/
+
+入力はディレクトリ（中の音声ファイルを再帰的に探す）か、1行に1ファイルのパスを書いた
+マニフェスト（.txt、または パスのリストの .json）。
+各ファイルについて、合成音声（.wav）・文字起こし（.txt）・タイミング（.json）を、入力と同じフォルダ構成で書き出す。
+.json は最後に書き出すため、.json があるファイルは処理済みとして再実行時にスキップする。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3")
+SEGMENT_GAP = 0.2  # 合成音声が元のタイミングより遅れた場合に、セグメント間に入れる最小の間（秒）
+
+# ワーカープロセス内の状態
+_batched_pipeline = None
+
+
+def find_sources(source):
+    """(入力ファイル, 出力名の基準になる相対パス) のリストを返す"""
+    source = Path(source)
+    if source.is_dir():
+        files = sorted(path for path in source.rglob("*") if path.suffix.lower() in AUDIO_EXTENSIONS)
+        return [(path, path.relative_to(source)) for path in files]
+
+    if source.suffix.lower() == ".json":
+        entries = json.loads(source.read_text(encoding="utf-8"))
+    else:
+        entries = [line.strip() for line in source.read_text(encoding="utf-8").splitlines()]
+        entries = [line for line in entries if line and not line.startswith("#")]
+    sources = []
+    for entry in entries:
+        path = Path(entry)
+        if not path.is_absolute():
+            path = source.parent / path
+        # 別のフォルダにある同じ名前のファイルが衝突しないよう、フォルダ構成を出力名に残す
+        path = path.resolve()
+        try:
+            relative = path.relative_to(source.parent.resolve())
+        except ValueError:
+            relative = Path(*path.parts[1:])
+        sources.append((path, relative))
+    return sources
+
+
+def output_paths(output_dir, relative):
+    base = Path(output_dir) / relative.with_suffix("")
+    return {
+        "audio": base.with_suffix(".wav"),
+        "text": base.with_suffix(".txt"),
+        "timing": base.with_suffix(".json"),
+    }
+
+
+def write_atomic(path, write):
+    """一時ファイルに書き出してから置き換える（中断されても中途半端なファイルを残さない）"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+# ワーカー
+def init_worker():
+    """各ワーカープロセスで一度だけモデルのロードを開始する"""
+    import main
+
+    main.models.start(["whisper", "bert", "aivm_metadata", "tts"])
+
+
+def transcribe_file(audio, batch_size):
+    """ファイル全体を文字起こしする（batch_size が2以上なら faster-whisper のバッチ推論を使う）"""
+    global _batched_pipeline
+    import main
+
+    whisper_model = main.models.get("whisper")
+    if batch_size > 1:
+        from faster_whisper import BatchedInferencePipeline
+
+        if _batched_pipeline is None:
+            _batched_pipeline = BatchedInferencePipeline(model=whisper_model)
+        segments, _ = _batched_pipeline.transcribe(audio, language="ja", batch_size=batch_size, **main.whisper_options)
+    else:
+        segments, _ = whisper_model.transcribe(audio, language="ja", **main.whisper_options)
+    return [
+        segment for segment in segments
+        if segment.avg_logprob >= main.AVG_LOGPROB_THRESHOLD and segment.no_speech_prob <= main.NO_SPEECH_PROB_THRESHOLD
+    ]
+
+
+def synthesize_text(text):
+    """main.py と同じ分割・キャッシュ・フェードで合成し、(サンプリングレート, 音声) を返す"""
+    import main
+    from audio_utils import fade_edges
+    from text_chunker import split_text
+
+    manifest = main.models.get("aivm_metadata").manifest
+    style = manifest.speakers[0].styles[0].name
+    sr = None
+    chunks = []
+    for chunk in split_text(text, main.MIN_CLAUSE_LENGTH):
+        cache_key = main.tts_cache.make_key(chunk, manifest.uuid, style, main.TTS_PARAMS)
+        cached = main.tts_cache.get(cache_key)
+        if cached is None:
+            cached = main.synthesize(chunk, style, main.TTS_PARAMS)
+            main.tts_cache.put(cache_key, *cached)
+        sr, audio = cached
+        chunks.append(fade_edges(audio, sr, main.CHUNK_FADE_DURATION))
+    if not chunks:
+        return None, None
+    return sr, np.concatenate(chunks)
+
+
+def transcode(source, paths, batch_size):
+    """1ファイルを処理して出力を書き出し、タイミング情報を返す（ワーカー上で実行）"""
+    import main
+
+    audio, sr = sf.read(source, dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)
+    if sr != main.STT_SAMPLERATE:
+        audio = soxr.resample(audio, sr, main.STT_SAMPLERATE)
+    duration = len(audio) / main.STT_SAMPLERATE
+
+    start_time = time.perf_counter()
+    segments = transcribe_file(audio, batch_size)
+    stt_time = time.perf_counter() - start_time
+
+    # 各セグメントの合成音声を元の発話の開始位置に置く（前のセグメントと重なる場合は後ろへずらす）
+    start_time = time.perf_counter()
+    out_sr = None
+    placed = []
+    timings = []
+    cursor = 0.0
+    for segment in segments:
+        sr, voice = synthesize_text(segment.text)
+        if voice is None:
+            continue
+        out_sr = sr
+        output_start = max(segment.start, cursor + SEGMENT_GAP) if placed else segment.start
+        placed.append((output_start, voice))
+        cursor = output_start + len(voice) / sr
+        timings.append({
+            "start": segment.start,
+            "end": segment.end,
+            "text": segment.text,
+            "output_start": output_start,
+            "output_end": cursor,
+        })
+    tts_time = time.perf_counter() - start_time
+
+    paths["audio"].parent.mkdir(parents=True, exist_ok=True)
+    if placed:
+        output = np.zeros(int(cursor * out_sr) + 1, dtype=np.float32)
+        for output_start, voice in placed:
+            offset = int(output_start * out_sr)
+            output[offset:offset + len(voice)] = voice
+        write_atomic(paths["audio"], lambda path: sf.write(path, output, out_sr, format="WAV"))
+    transcript = "\n".join(timing["text"].strip() for timing in timings)
+    write_atomic(paths["text"], lambda path: path.write_text(transcript + "\n", encoding="utf-8"))
+
+    result = {
+        "source": str(source),
+        "duration": duration,
+        "stt_time": stt_time,
+        "tts_time": tts_time,
+        "stt_rtf": stt_time / duration if duration > 0 else None,
+        "output_audio": paths["audio"].name if placed else None,
+        "output_samplerate": out_sr,
+        "segments": timings,
+    }
+    # .json の存在を処理済みの目印にするため、最後に書き出す
+    write_atomic(paths["timing"], lambda path: path.write_text(
+        json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8"
+    ))
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Transcribe and re-voice recorded audio files")
+    parser.add_argument("source", help="directory of audio files, or a manifest (.txt / .json) listing them")
+    parser.add_argument("--output", default="transcoded", help="output directory")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes (each loads its own models)")
+    parser.add_argument("--batch-size", type=int, default=8, help="faster-whisper batch size (1 disables batched inference)")
+    parser.add_argument("--overwrite", action="store_true", help="process files that already have outputs")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    sources = find_sources(args.source)
+    jobs = []
+    for source, relative in sources:
+        paths = output_paths(args.output, relative)
+        if paths["timing"].exists() and not args.overwrite:
+            continue
+        jobs.append((source, paths))
+    skipped = len(sources) - len(jobs)
+    print(f"{len(sources)} files found, {skipped} already done, {len(jobs)} to process with {args.workers} worker(s)")
+    if not jobs:
+        return
+
+    start_time = time.perf_counter()
+    done = 0
+    failed = []
+    audio_duration = 0.0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        futures = {pool.submit(transcode, source, paths, args.batch_size): source for source, paths in jobs}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # 失敗したファイルは .json を書き出さないため、再実行時にもう一度処理される
+                print(f"Failed: {source}: {e!r}")
+                failed.append(source)
+                continue
+            done += 1
+            audio_duration += result["duration"]
+            elapsed = time.perf_counter() - start_time
+            files_per_hour = done / elapsed * 3600
+            remaining = (len(jobs) - done - len(failed)) / files_per_hour * 3600
+            print(f"[{done}/{len(jobs)}] {source} (STT {result['stt_time']:.1f}s, TTS {result['tts_time']:.1f}s) "
+                  f"{files_per_hour:.1f} files/hour, ETA {remaining / 60:.1f} min")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Processed {done} files ({audio_duration / 60:.1f} min of audio) in {elapsed / 60:.1f} min: "
+          f"{done / elapsed * 3600:.1f} files/hour, {audio_duration / elapsed:.1f}x real time")
+    if failed:
+        print(f"{len(failed)} file(s) failed; run again to retry them.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,477 @@
+"""STT→TTS パイプラインのオフラインベンチマーク
+
+WAV ファイルのコーパスを main.py の録音コールバックに直接流し込み、main.py と同じ
+ステージ関数（process_whisper / process_tts / process_sound）で処理する。
+再生はヌルシンクに差し替えるため、実時間より速く回せる。
+
+    python benchmark.py corpus/ --output result.json
+    python benchmark.py --stub --synthetic 20 --baseline baseline.json
+
+--stub を付けるとモデルをダウンロード不要の小さなスタブに差し替える（CPU のみの環境向け）。
+既定では発話を1つずつ流し、処理し終えてから次の発話を流す（発話ごとのレイテンシを計測する）。
+--back-to-back を付けるとコーパス全体を1本の音声として続けて流し、最後に1回だけ処理の完了を待つ
+（ある発話の STT と前の発話の TTS が重なるため、スループットと CPU の取り合いを計測できる）。
+実時間より速く流す場合は、main.py のファイル入力と同じく capture_ready() で処理が追いつくのを待ち、
+録音時刻は STT が受け取った時点を基準にする。遅延の上限（LATENCY_BUDGET）は --latency-budget で指定した場合だけ有効にする。
+"""
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+import main
+from audio_backends import NullOutput
+from tts_cache import TTSCache
+from warmup import dummy_speech
+
+# 発話の前後に付ける無音（秒）。前はノイズフロアの推定用、後ろは発話終了の検出用
+LEAD_SILENCE = 0.5
+TRAIL_SILENCE = main.END_OF_SPEECH_DURATION + 0.5
+
+# スタブの文字起こし結果に使う文字列
+STUB_TEXT = "今日はいい天気ですね、散歩に行きましょう。明日は雨が降るそうです。"
+STUB_WORD_DURATION = 0.25  # スタブの1単語あたりの長さ（秒）
+STUB_SEGMENT_DURATION = 3.0  # スタブの1セグメントあたりの長さ（秒）
+STUB_TTS_SAMPLERATE = 44100
+STUB_TTS_CHAR_DURATION = 0.12  # スタブの合成音声の1文字あたりの長さ（秒）
+
+# ベースラインとの比較で使う指標
+COMPARED_QUANTILES = ("p50", "p90")
+MIN_LATENCY_DIFFERENCE = 0.005  # これより小さいレイテンシの差（秒）は計測誤差として扱う
+
+
+# スタブモデル
+class StubWhisperModel:
+    """音声の長さに応じた固定の文字起こし結果を返す Whisper のスタブ"""
+
+    def __init__(self, rtf):
+        self.rtf = rtf
+
+    def transcribe(self, audio, language=None, word_timestamps=False, **options):
+        duration = len(audio) / main.STT_SAMPLERATE
+        # 推論の代わりに、音声の長さに比例した時間だけ待つ（GIL を手放す点もネイティブ推論と同じ）
+        time.sleep(duration * self.rtf)
+        segments = []
+        n_words = int(duration / STUB_WORD_DURATION)
+        words_per_segment = int(STUB_SEGMENT_DURATION / STUB_WORD_DURATION)
+        for first in range(0, n_words, words_per_segment):
+            words = [
+                SimpleNamespace(
+                    start=i * STUB_WORD_DURATION,
+                    end=(i + 1) * STUB_WORD_DURATION,
+                    word=STUB_TEXT[i % len(STUB_TEXT)],
+                    probability=1.0,
+                )
+                for i in range(first, min(first + words_per_segment, n_words))
+            ]
+            segments.append(SimpleNamespace(
+                start=words[0].start,
+                end=words[-1].end,
+                text="".join(word.word for word in words),
+                words=words if word_timestamps else None,
+                avg_logprob=-0.1,
+                no_speech_prob=0.0,
+            ))
+        return iter(segments), SimpleNamespace(language=language, duration=duration)
+
+
+@dataclasses.dataclass
+class StubSegment:
+    seek: int
+    start: float
+    end: float
+    text: str
+    avg_logprob: float
+    no_speech_prob: float
+
+
+class StubBatchedPipeline:
+    """faster-whisper 1.1.1 の BatchedInferencePipeline と同じ形で結果を返すスタブ
+
+    区間ごとにスタブの Whisper で文字起こしし、時刻を連結した音声の先頭からの秒数にする。
+    seek は本物と同じく区間の開始時刻を 10ms 単位に切り捨てた値にする。
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def transcribe(self, audio, language=None, clip_timestamps=None, batch_size=8, **options):
+        segments = []
+        for clip in clip_timestamps:
+            start_time = clip["start"] / main.STT_SAMPLERATE
+            clip_segments, _ = self.model.transcribe(audio[clip["start"]:clip["end"]], language, **options)
+            for segment in clip_segments:
+                segments.append(StubSegment(
+                    seek=int(start_time * 100),
+                    start=start_time + segment.start,
+                    end=start_time + segment.end,
+                    text=segment.text,
+                    avg_logprob=segment.avg_logprob,
+                    no_speech_prob=segment.no_speech_prob,
+                ))
+        return iter(segments), SimpleNamespace(language=language, duration=len(audio) / main.STT_SAMPLERATE)
+
+
+class StubTTSModel:
+    """文字数に応じた長さの正弦波を返す Style-Bert-VITS2 のスタブ"""
+
+    def __init__(self, rtf):
+        self.rtf = rtf
+
+    def infer(self, text, style=None, **params):
+        duration = max(len(text), 1) * STUB_TTS_CHAR_DURATION
+        time.sleep(duration * self.rtf)
+        t = np.arange(int(STUB_TTS_SAMPLERATE * duration)) / STUB_TTS_SAMPLERATE
+        audio = (0.1 * np.sin(2 * np.pi * 220 * t) * np.iinfo(np.int16).max).astype(np.int16)
+        return STUB_TTS_SAMPLERATE, audio
+
+
+def stub_aivm_metadata():
+    style = SimpleNamespace(name="ノーマル")
+    return SimpleNamespace(manifest=SimpleNamespace(
+        uuid="00000000-0000-0000-0000-000000000000",
+        speakers=[SimpleNamespace(styles=[style])],
+    ))
+
+
+def use_stub_models(stt_rtf, tts_rtf):
+    """main.models のローダーをスタブに差し替える（ダウンロード・ウォームアップなし）"""
+    stubs = {
+        "whisper": lambda: StubWhisperModel(stt_rtf),
+        "bert": lambda: None,
+        "aivm_metadata": stub_aivm_metadata,
+        "tts": lambda: StubTTSModel(tts_rtf),
+        "whisper_fast": lambda: StubWhisperModel(stt_rtf / 2),
+    }
+    for name, loader in stubs.items():
+        if name not in main.models.loaders:
+            continue
+        main.models.register(name, loader, lazy=name in main.models.lazy)
+        main.models.warmups.pop(name, None)
+    main.BatchedInferencePipeline = StubBatchedPipeline
+
+
+def check_batch_mapping():
+    """まとめてデコードした結果が元の発話に戻るかを確かめる（長さが 10ms 単位に揃っていない発話で）"""
+    lengths = (48123, 41888, 30001)
+    clips = [dummy_speech(main.STT_SAMPLERATE, length / main.STT_SAMPLERATE, seed=i) for i, length in enumerate(lengths)]
+    results = main.transcribe_batch(clips)
+    for i, (length, segments) in enumerate(zip(lengths, results)):
+        duration = length / main.STT_SAMPLERATE
+        if not segments or any(segment.start < 0 or segment.end > duration + 1e-6 for segment in segments):
+            sys.exit(f"Batched STT mapped segments to the wrong utterance (clip {i}: "
+                     f"{[(segment.start, segment.end) for segment in segments]}, duration {duration:.3f}s)")
+
+
+# コーパス
+def load_corpus(paths):
+    """WAV ファイル（ディレクトリの場合は中の *.wav）を 16kHz モノラルの float32 で読み込む"""
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*.wav")) if path.is_dir() else [path])
+    corpus = []
+    for file in files:
+        audio, sr = sf.read(file, dtype="float32", always_2d=True)
+        audio = audio.mean(axis=1)
+        if sr != main.STT_SAMPLERATE:
+            audio = soxr.resample(audio, sr, main.STT_SAMPLERATE)
+        corpus.append((file.name, audio.astype(np.float32)))
+    return corpus
+
+
+def synthetic_corpus(count, duration=3.0):
+    """ダミー音声のコーパスを生成する（シードを固定しているので毎回同じ内容になる）"""
+    return [
+        (f"synthetic_{i:03d}", dummy_speech(main.STT_SAMPLERATE, duration, seed=i))
+        for i in range(count)
+    ]
+
+
+# 実行
+async def feed(audio, realtime):
+    """録音コールバックにブロック単位で音声を流し込む（実時間より速く流す場合は処理が追いつくのを待つ）"""
+    blocksize = round(main.BLOCKSIZE * main.STT_SAMPLERATE / main.SAMPLERATE)
+    audio = np.concatenate([
+        np.zeros(int(LEAD_SILENCE * main.STT_SAMPLERATE), np.float32),
+        audio,
+        np.zeros(int(TRAIL_SILENCE * main.STT_SAMPLERATE), np.float32),
+    ])
+    for offset in range(0, len(audio), blocksize):
+        block = audio[offset:offset + blocksize]
+        if not realtime:
+            # 未処理の録音がリングバッファから溢れないよう、STTが追いつくまで待つ
+            while not main.capture_ready():
+                await asyncio.sleep(0.005)
+        main.audio_callback(block[:, np.newaxis], len(block), None, None)
+        if realtime:
+            await asyncio.sleep(len(block) / main.STT_SAMPLERATE)
+        else:
+            # コールバックから投入された作業をステージが受け取れるようにする
+            await asyncio.sleep(0)
+
+
+async def drain():
+    """上流から順に各ステージのキューが空になるまで待つ"""
+    await asyncio.sleep(0)
+    for stage in (main.audio_stage, main.segment_stage, main.sound_stage):
+        await stage.queue.join()
+
+
+def playback_times(first_trace_id, last_trace_id):
+    """トレース ID の範囲の発話について、(最初の再生開始, 最後の再生終了) を返す（再生がなければ None）"""
+    spans = [
+        event for event in main.tracer.events
+        if event["name"] == "playback" and first_trace_id <= event["args"].get("trace_id", 0) <= last_trace_id
+    ]
+    if not spans:
+        return None, None
+    return (min(event["ts"] for event in spans) / 1e6,
+            max(event["ts"] + event["dur"] for event in spans) / 1e6)
+
+
+async def run_benchmark(corpus, realtime, adaptive_quality=False, back_to_back=False):
+    output = NullOutput(realtime)
+    main.audio_output = output
+    main.realtime_capture = realtime
+
+    main.models.start()
+    for name in main.models.loaders:
+        if name not in main.models.lazy:
+            await main.models.wait(name)
+    tasks = [stage.start() for stage in (main.audio_stage, main.segment_stage, main.sound_stage)]
+    # 既定では品質を切り替えず、常に同じ設定で計測する（ベースラインと比較できるように）
+    if adaptive_quality:
+        tasks.append(asyncio.create_task(main.quality.run()))
+
+    main.tracer.enabled = True
+    main.tracer.events.clear()
+    utterances = []
+    start_time = time.perf_counter()
+    if back_to_back:
+        # 前の発話の処理を待たずに続けて流し、発話ごとの結果は再生のスパンのトレース ID から集める
+        fed = []
+        for name, audio in corpus:
+            first_trace_id = (main.current_trace_id or 0) + 1
+            await feed(audio, realtime)
+            fed.append((name, audio, first_trace_id, main.current_trace_id or 0, time.perf_counter()))
+        await drain()
+        for name, audio, first_trace_id, last_trace_id, fed_time in fed:
+            first_play, last_play = playback_times(first_trace_id, last_trace_id)
+            utterances.append({
+                "name": name,
+                "duration": len(audio) / main.STT_SAMPLERATE,
+                "first_audio": first_play - fed_time if first_play is not None else None,
+                "completion": last_play - fed_time if last_play is not None else None,
+            })
+    else:
+        for name, audio in corpus:
+            played_before = len(output.play_times)
+            await feed(audio, realtime)
+            fed_time = time.perf_counter()
+            await drain()
+            done_time = time.perf_counter()
+            play_times = output.play_times[played_before:]
+            utterances.append({
+                "name": name,
+                "duration": len(audio) / main.STT_SAMPLERATE,
+                # 流し込み終えてから最初の再生開始まで・すべての処理が終わるまで
+                # （ストリーミング時は発話の途中で再生が始まると負の値になる）
+                "first_audio": play_times[0] - fed_time if play_times else None,
+                "completion": done_time - fed_time,
+            })
+    wall_time = time.perf_counter() - start_time
+
+    for task in tasks:
+        task.cancel()
+    main.executors.shutdown()
+    return utterances, wall_time, output.played_duration
+
+
+def distribution(values):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p90": float(np.percentile(values, 90)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def peak_rss_bytes():
+    """プロセスの最大常駐メモリ（バイト）"""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux は KB、macOS はバイト単位
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    # Windows
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+    return counters.PeakWorkingSetSize
+
+
+def summarize(utterances, wall_time, played_duration, args):
+    # ステージごとのレイテンシはトレースのスパンから集計する
+    spans = {}
+    for event in main.tracer.events:
+        spans.setdefault(event["name"], []).append(event["dur"] / 1e6)
+    audio_duration = sum(utterance["duration"] for utterance in utterances)
+    first_audio = [u["first_audio"] for u in utterances if u["first_audio"] is not None]
+    completion = [u["completion"] for u in utterances if u["completion"] is not None]
+    return {
+        "config": {
+            "stub": args.stub,
+            "realtime": args.realtime,
+            "back_to_back": args.back_to_back,
+            "latency_budget": args.latency_budget,
+            "streaming": main.STREAMING_STT,
+            "adaptive_quality": args.adaptive_quality,
+            "utterances": len(utterances),
+        },
+        "latency": {name: distribution(values) for name, values in sorted(spans.items())},
+        "end_to_end": {
+            "first_audio": distribution(first_audio),
+            "completion": distribution(completion),
+        },
+        "throughput": {
+            "wall_time": wall_time,
+            "audio_seconds": audio_duration,
+            "realtime_factor": audio_duration / wall_time if wall_time > 0 else None,
+            "utterances_per_second": len(utterances) / wall_time if wall_time > 0 else None,
+            "synthesized_seconds": played_duration,
+        },
+        "model_load_times": dict(main.models.load_times),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "utterances": utterances,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """ベースラインに対して tolerance を超えて悪化した指標を返す"""
+    regressions = []
+
+    def check(name, current, previous, higher_is_better=False, min_difference=0.0):
+        if current is None or previous in (None, 0):
+            return
+        ratio = current / previous
+        worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+        worse = worse and abs(current - previous) > min_difference
+        print(f"{name:<40} {previous:12.4g} -> {current:12.4g} (x{ratio:.2f}){'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(name)
+
+    for group in ("latency", "end_to_end"):
+        for name, current in result[group].items():
+            previous = baseline.get(group, {}).get(name)
+            if previous is None:
+                continue
+            for quantile in COMPARED_QUANTILES:
+                check(f"{name}.{quantile}", current.get(quantile), previous.get(quantile),
+                      min_difference=MIN_LATENCY_DIFFERENCE)
+    check("throughput.realtime_factor", result["throughput"]["realtime_factor"],
+          baseline["throughput"]["realtime_factor"], higher_is_better=True)
+    check("peak_rss_bytes", result["peak_rss_bytes"], baseline["peak_rss_bytes"])
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the STT -> TTS pipeline")
+    parser.add_argument("corpus", nargs="*", help="WAV files or directories containing WAV files")
+    parser.add_argument("--synthetic", type=int, default=0, help="number of generated utterances to add to the corpus")
+    parser.add_argument("--stub", action="store_true", help="use tiny stub models instead of Whisper / Style-Bert-VITS2")
+    parser.add_argument("--stub-stt-rtf", type=float, default=0.1, help="real-time factor of the stub Whisper model")
+    parser.add_argument("--stub-tts-rtf", type=float, default=0.2, help="real-time factor of the stub TTS model")
+    parser.add_argument("--realtime", action="store_true", help="feed audio and play output at real-time speed")
+    parser.add_argument("--back-to-back", action="store_true",
+                        help="feed the whole corpus as one stream and drain once, so STT and TTS of different utterances overlap")
+    parser.add_argument("--latency-budget", type=float, help="drop segments later than this (seconds); off by default")
+    parser.add_argument("--no-streaming", action="store_true", help="transcribe whole utterances instead of streaming")
+    parser.add_argument("--adaptive-quality", action="store_true", help="let the quality controller switch settings under load")
+    parser.add_argument("--cache", action="store_true", help="keep the in-memory TTS cache enabled")
+    parser.add_argument("--output", help="write the result JSON to this file")
+    parser.add_argument("--baseline", help="compare against a result JSON and exit with 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression against the baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own log output")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    corpus = load_corpus(args.corpus) + synthetic_corpus(args.synthetic)
+    if not corpus:
+        sys.exit("No audio to benchmark. Pass WAV files or --synthetic N.")
+
+    if args.stub:
+        use_stub_models(args.stub_stt_rtf, args.stub_tts_rtf)
+    if args.no_streaming:
+        main.STREAMING_STT = False
+    main.LATENCY_BUDGET = args.latency_budget
+    # コーパスは会話ではないため、次の発話の開始で前の発話の出力を打ち切らない
+    main.BARGE_IN = False
+    # キャッシュのヒットで結果が変わらないよう、既定ではメモリ・ディスクともに無効にする
+    main.tts_cache = TTSCache(main.TTS_CACHE_MAX_BYTES if args.cache else 0, None)
+
+    log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with log:
+        if args.stub:
+            check_batch_mapping()
+        utterances, wall_time, played_duration = asyncio.run(
+            run_benchmark(corpus, args.realtime, args.adaptive_quality, args.back_to_back)
+        )
+    result = summarize(utterances, wall_time, played_duration, args)
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+        print(f"Benchmark result written to {args.output}")
+    else:
+        print(text)
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,184 @@
+"""STT（CTranslate2）と TTS・BERT（ONNX Runtime）への CPU コアの割り当て
+
+各エンジンはそのままだと全コア分のスレッドプールを作るため、STT と TTS が重なると
+CPU を取り合って両方とも遅くなる。CpuBudget はエンジンごとのスレッド数と
+（pin=True の場合）使うコアを決める。
+
+    budget = CpuBudget({"stt": 4, "tts": 4}, pin=True)
+    WhisperModel(..., cpu_threads=budget.threads("stt"))
+    with budget.pinned("tts"):  # この中で作られたスレッドプールは割り当てたコアに固定される
+        tts_model.load()
+
+"bert" を省略した場合、BERT は TTS のコアを共有する（1回の合成の中で BERT と VITS は交互に動くため）。
+コアの固定は os.sched_setaffinity が使える環境（Linux）でのみ行う。
+
+最適な割り当てはマシンによって異なるため、ベンチマークで探索できる
+（STT と TTS が重なった状態で比べるため、benchmark.py は --back-to-back で実行する）:
+
+    python cpu_budget.py corpus/
+    python cpu_budget.py --stub --synthetic 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+ENGINES = ("stt", "tts", "bert")
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_budget(text):
+    """"stt=4,tts=4" の形式を辞書にする"""
+    budget = {}
+    for entry in text.split(","):
+        name, _, threads = entry.partition("=")
+        budget[name.strip()] = int(threads)
+    return budget
+
+
+class CpuBudget:
+    def __init__(self, threads=None, pin=False, cores=None):
+        self.budget = dict(threads or {})
+        unknown = set(self.budget) - set(ENGINES)
+        if unknown:
+            raise ValueError(f"Unknown engines in CPU budget: {', '.join(sorted(unknown))}")
+        if "bert" not in self.budget and "tts" in self.budget:
+            self.threads_by_engine = dict(self.budget, bert=self.budget["tts"])
+        else:
+            self.threads_by_engine = dict(self.budget)
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        self.cores = self._plan(cores or available_cores()) if self.pin else {}
+
+    @classmethod
+    def from_env(cls, threads=None, pin=False):
+        """環境変数 CPU_BUDGET（"stt=4,tts=4"）があれば threads の代わりに使う"""
+        text = os.environ.get("CPU_BUDGET")
+        if text:
+            threads = parse_budget(text)
+        pin = os.environ.get("CPU_AFFINITY", str(int(pin))) not in ("", "0")
+        return cls(threads, pin)
+
+    def _plan(self, cores):
+        """エンジンごとに連続したコアを割り当てる（固定しない場合はコア数を超えてもよい）"""
+        total = sum(self.budget.values())
+        if total > len(cores):
+            raise ValueError(f"CPU budget pins {total} cores but only {len(cores)} are available")
+        plan = {}
+        offset = 0
+        for name in ENGINES:
+            if name in self.budget:
+                plan[name] = cores[offset:offset + self.budget[name]]
+                offset += self.budget[name]
+        if "bert" not in plan and "tts" in plan:
+            plan["bert"] = plan["tts"]
+        return plan
+
+    def threads(self, name):
+        """エンジンのスレッド数（割り当てがなければ 0 = 各ライブラリの既定値）"""
+        return self.threads_by_engine.get(name, 0)
+
+    def ort_options(self, name, config):
+        """ORT のセッション設定に、割り当てたスレッド数を反映したものを返す（明示された値はそのまま）"""
+        config = dict(config)
+        if self.threads(name):
+            if config.get("intra_op_num_threads") is None:
+                config["intra_op_num_threads"] = self.threads(name)
+            if config.get("inter_op_num_threads") is None:
+                config["inter_op_num_threads"] = 1
+        return config
+
+    def pin_thread(self, name):
+        """呼び出したスレッド（と、これから作るスレッド）を割り当てたコアに固定する"""
+        if self.pin and self.cores.get(name):
+            os.sched_setaffinity(0, self.cores[name])
+
+    @contextmanager
+    def pinned(self, name):
+        """この中で作られたスレッドプールを割り当てたコアに固定し、終わったら元に戻す"""
+        if not (self.pin and self.cores.get(name)):
+            yield
+            return
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, self.cores[name])
+        try:
+            yield
+        finally:
+            os.sched_setaffinity(0, previous)
+
+    def describe(self):
+        if not self.budget:
+            return "CPU budget: not set (each engine uses its default thread count)"
+        parts = []
+        for name, threads in self.threads_by_engine.items():
+            parts.append(f"{name} {threads} threads" + (f" on cores {self.cores[name]}" if self.pin else ""))
+        return "CPU budget: " + ", ".join(parts)
+
+
+# 割り当ての探索
+def candidate_splits(cores, min_threads=1):
+    """STT と TTS にコアを分ける割り当ての候補（BERT は TTS と共有）"""
+    return [{"stt": stt, "tts": cores - stt} for stt in range(min_threads, cores - min_threads + 1)]
+
+
+def run_benchmark(budget, pin, benchmark_args):
+    """割り当てを環境変数で渡して benchmark.py を別プロセスで実行し、結果の JSON を返す"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output = Path(tmp_dir) / "result.json"
+        env = dict(os.environ)
+        env["CPU_BUDGET"] = ",".join(f"{name}={threads}" for name, threads in budget.items())
+        env["CPU_AFFINITY"] = "1" if pin else "0"
+        command = [sys.executable, str(Path(__file__).with_name("benchmark.py")), *benchmark_args, "--output", str(output)]
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        return json.loads(output.read_text(encoding="utf-8"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Search for the STT / TTS core split with the best end-to-end throughput")
+    parser.add_argument("corpus", nargs="*", help="WAV files or directories passed to benchmark.py")
+    parser.add_argument("--synthetic", type=int, default=0, help="number of generated utterances to add to the corpus")
+    parser.add_argument("--stub", action="store_true", help="use stub models (only checks that the search runs)")
+    parser.add_argument("--cores", type=int, default=len(available_cores()), help="number of cores to split")
+    parser.add_argument("--min-threads", type=int, default=1, help="minimum threads for each engine")
+    parser.add_argument("--pin", action="store_true", help="also pin each engine to its cores")
+    parser.add_argument("--output", help="write all results as JSON to this file")
+    return parser.parse_args()
+
+
+def search():
+    args = parse_args()
+    # 発話ごとに処理の完了を待つと STT と TTS が重ならず、CPU の取り合いが計測に現れない
+    benchmark_args = [*args.corpus, "--back-to-back"]
+    if args.synthetic:
+        benchmark_args += ["--synthetic", str(args.synthetic)]
+    if args.stub:
+        benchmark_args.append("--stub")
+
+    results = []
+    for budget in candidate_splits(args.cores, args.min_threads):
+        result = run_benchmark(budget, args.pin, benchmark_args)
+        throughput = result["throughput"]["realtime_factor"]
+        completion = result["end_to_end"]["completion"].get("p50")
+        results.append({"budget": budget, "realtime_factor": throughput, "completion_p50": completion})
+        print(f"stt={budget['stt']:<3} tts={budget['tts']:<3} "
+              f"throughput x{throughput:.2f} real time, completion p50 {completion or 0:.2f}s")
+    if not results:
+        sys.exit(f"Cannot split {args.cores} core(s) with at least {args.min_threads} thread(s) each")
+
+    best = max(results, key=lambda result: result["realtime_factor"] or 0)
+    print(f"Best split: CPU_BUDGET = {best['budget']} (x{best['realtime_factor']:.2f} real time)")
+    if args.output:
+        Path(args.output).write_text(json.dumps({"best": best, "results": results}, indent=2), encoding="utf-8")
+        print(f"Search results written to {args.output}")
+
+
+if __name__ == "__main__":
+    search()
@@ -0,0 +1,69 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+EXECUTOR_CLASSES = {
+    "thread": ThreadPoolExecutor,
+    "process": ProcessPoolExecutor,
+}
+
+
+class ExecutorLayer:
+    """STT・TTS・再生などの重い処理をイベントループの外のワーカーで実行する"""
+
+    def __init__(self, config, initializers=None):
+        # config: {名前: (種類, ワーカー数)} 例: {"stt": ("thread", 1)}
+        # "process" を指定した場合、各ワーカープロセスが main.py を読み込み直してモデルを個別にロードする
+        # initializers: {名前: 各ワーカーの開始時に呼ぶ関数}（CPU コアの固定など）
+        initializers = initializers or {}
+        self.executors = {
+            name: EXECUTOR_CLASSES[kind](max_workers=max_workers, initializer=initializers.get(name))
+            for name, (kind, max_workers) in config.items()
+        }
+
+        # cProfile で計測するワーカー（名前 -> StageProfiler）
+        self.profilers = {}
+
+        # 並行実行の効果を測るための集計（イベントループ上でのみ更新する）
+        self.busy_time = {name: 0.0 for name in config}
+        self.active_time = 0.0
+        self._active_jobs = 0
+        self._active_since = 0.0
+
+    async def run(self, name, func, *args, **kwargs):
+        """指定したワーカーで func を実行し、完了を待つ"""
+        loop = asyncio.get_running_loop()
+        if name in self.profilers:
+            func = self.profilers[name].wrap(func)
+        start_time = time.perf_counter()
+        if self._active_jobs == 0:
+            self._active_since = start_time
+        self._active_jobs += 1
+        try:
+            return await loop.run_in_executor(
+                self.executors[name], functools.partial(func, *args, **kwargs)
+            )
+        finally:
+            end_time = time.perf_counter()
+            self.busy_time[name] += end_time - start_time
+            self._active_jobs -= 1
+            if self._active_jobs == 0:
+                self.active_time += end_time - self._active_since
+
+    def overlap_gain(self):
+        """逐次実行に対するスループット倍率（全ワーカーの稼働時間の合計 / 何かが稼働していた実時間）"""
+        active_time = self.active_time
+        if self._active_jobs > 0:
+            active_time += time.perf_counter() - self._active_since
+        if active_time <= 0:
+            return 1.0
+        return sum(self.busy_time.values()) / active_time
+
+    def report(self):
+        busy = ", ".join(f"{name}: {busy_time:.2f}s" for name, busy_time in self.busy_time.items())
+        print(f"Executor busy time [{busy}] over {self.active_time:.2f}s wall, overlap gain: x{self.overlap_gain():.2f}")
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
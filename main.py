@@ -1,15 +1,17 @@
 import asyncio
-import sounddevice as sd
+import dataclasses
+import functools
+import os
 import numpy as np
 import time
 import soundfile as sf
-import librosa
+import soxr
 from pathlib import Path
 from io import BytesIO
 import time
 import asyncio
 
-from faster_whisper import WhisperModel
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 
 from style_bert_vits2.constants import Languages
 from style_bert_vits2.models.hyper_parameters import HyperParameters
@@ -19,6 +21,25 @@ from style_bert_vits2.tts_model import TTSModel
 
 import aivmlib_py310.aivmlib as aivmlib
 
+from audio_backends import create_input, create_output, load_audio_config
+from audio_utils import fade_edges, split_at_quiet_points
+from cpu_budget import CpuBudget
+from executors import ExecutorLayer
+from metrics import RTF_BUCKETS, REGISTRY, Counter, Gauge, Histogram
+from model_registry import ModelRegistry
+from ort_session import cache_path, session_profile
+from pipeline import SHED_ITEMS, Stage
+from playout import PlayoutScheduler
+from quality import QualityController
+from ring_buffer import RingBuffer
+from streaming_stt import PARTIAL, StreamingTranscriber
+from text_chunker import split_text
+from tracing import StageProfiler, Tracer, instrument_bert
+from tts_cache import TTSCache
+from warmup import warmup_tts, warmup_whisper
+from whisper_autotune import load_whisper_config
+from vad import SPEECH_END, SPEECH_START, VadSegmenter
+
 # AIVMXファイルパス
 AIVMX_PATH = "models/Anneli.aivmx" # <- ダウンロードしたAIVMXファイルのパス
 
@@ -27,241 +48,947 @@ MIC_DEVICE = 11 # <- ここにマイクのデバイスID
 MONITOR_DEVICE = 13 # <-ここにモニター出力のデバイスID
 SPEEKER_DEVICE = 14 # <-ここにスピーカー出力のデバイスID
 
+# 音声の入出力（AUDIO_CONFIG_PATH の JSON ファイルがあればそちらの設定を使う）
+# 入力は "sounddevice" / "wav"、出力は "sounddevice" / "wav" / "null" を指定できる（audio_backends.py を参照）
+AUDIO_CONFIG_PATH = os.environ.get("AUDIO_CONFIG", "audio_config.json")
+AUDIO_INPUT = {"backend": "sounddevice", "device": MIC_DEVICE}
+AUDIO_OUTPUTS = [
+    {"backend": "sounddevice", "device": MONITOR_DEVICE},
+    {"backend": "sounddevice", "device": SPEEKER_DEVICE},
+]
+
+# Whisperのモデルとデコード設定（WHISPER_CONFIG_PATH は whisper_autotune.py で保存した設定。なければ既定値）
+WHISPER_MODEL = "turbo"
+WHISPER_CONFIG_PATH = "whisper_config.json"
+
 # カスタムキャッシュディレクトリを指定
 custom_cache_dir = "models/"
 
 device = "cpu"
 
-# Whisperモデルのロード
-# whisper_model = whisper.load_model("turbo", download_root=custom_cache_dir)  # 必要に応じてモデルサイズを変更可能
-whisper_model = WhisperModel("turbo", download_root=custom_cache_dir)
-# asteroid_model = BaseModel.from_pretrained("mpariente/DPRNNTasNet-ks2_WHAM_sepclean", device=device, cache_dir=custom_cache_dir)
-
 aivmx_path = Path(AIVMX_PATH)
 
 onnx_providers = [("CPUExecutionProvider", {
     "arena_extend_strategy": "kSameAsRequested",
 })]
 
+# ONNX Runtime のセッション設定（None の項目は ORT の既定値。ort_session.py を参照）
+# graph_optimization_level: "disable" / "basic" / "extended" / "all"、execution_mode: "sequential" / "parallel"
+ORT_SESSION_OPTIONS = {
+    "tts": {
+        "intra_op_num_threads": None,
+        "inter_op_num_threads": None,
+        "graph_optimization_level": "all",
+        "enable_mem_pattern": True,
+        "execution_mode": "sequential",
+    },
+    "bert": {
+        "intra_op_num_threads": None,
+        "inter_op_num_threads": None,
+        "graph_optimization_level": "all",
+        "enable_mem_pattern": True,
+        "execution_mode": "sequential",
+    },
+}
+# STT（CTranslate2）と TTS・BERT（ONNX Runtime）に割り当てる CPU のスレッド数（cpu_budget.py を参照）
+# 例: {"stt": 4, "tts": 4}。"bert" を省略すると BERT は TTS のスレッドを共有する。None の場合は各ライブラリの既定値
+# 環境変数 CPU_BUDGET="stt=4,tts=4" で上書きできる。最適な割り当ては python cpu_budget.py corpus/ で探索できる
+CPU_BUDGET = None
+CPU_AFFINITY = False  # True の場合、各エンジンのスレッドを割り当てたコアに固定する（Linux のみ）
+ORT_CACHE_DIR = "models/ort_cache"  # 最適化済みモデルの保存先（None で毎回最適化する）
+BERT_MODEL_NAME = "tsukumijima/deberta-v2-large-japanese-char-wwm-onnx"
+BERT_MODEL_REVISION = "d701ec67708287b20d2063270f6b535e6eed09ab"
+
 # 録音設定
-SAMPLERATE = 44100  # サンプリングレート
+SAMPLERATE = 44100  # サンプリングレート（マイクが16kHzで録音できない場合に使用）
+STT_SAMPLERATE = 16000  # Whisperに渡すサンプリングレート。録音時点でこのレートに揃える
 CHANNELS = 1  # モノラル録音
 BLOCKSIZE = 1024  # フレームサイズ
-THRESHOLD = 0.01  # 録音開始のボリューム閾値
-SILENCE_DURATION = 2.0  # 無音とみなす継続時間（秒）
+THRESHOLD = 0.01  # 録音開始のボリューム閾値（ノイズフロアが低い場合の最小値）
+NOISE_RATIO = 3.0  # 推定ノイズフロアに対する録音開始閾値の倍率
+ONSET_DURATION = 0.05  # 発話開始とみなすのに必要な有声区間の長さ（秒）
+END_OF_SPEECH_DURATION = 0.5  # 発話終了とみなす無音の継続時間（秒）
+PRE_ROLL_DURATION = 0.3  # 発話開始前にさかのぼって録音に含める長さ（秒）
+POST_ROLL_DURATION = 0.15  # 最後の有声区間の後に残す長さ（秒）。それ以降の無音は切り詰める
 TARGET_VOLUME = 0.1  # 正規化後のターゲットボリューム（RMS値）
 # 最大音量閾値を設定（例: RMS値が0.5以上の場合、無視する）
 MAX_VOLUME_THRESHOLD = 0.5
+RING_BUFFER_DURATION = 60.0  # 録音用リングバッファの長さ（秒）
+# ファイル入力を実時間より速く流す場合に、未処理の録音の後ろに残しておくリングバッファの余裕（秒）
+# （RING_BUFFER_DURATION - MAX_RECORDING_DURATION より小さくすること）
+CAPTURE_HEADROOM = 5.0
+MAX_RECORDING_DURATION = 30.0  # 1発話の最大録音時間（秒）。超えた場合はそこで区切る
 
 # 信頼スコアのしきい値
 AVG_LOGPROB_THRESHOLD = -1.0
 NO_SPEECH_PROB_THRESHOLD = 0.6
 
-# 状態管理
-recording = False  # 録音中かどうか
-audio_buffer = []  # 録音された音声データ
-silence_counter = 0  # 無音フレームのカウンタ
-
-# 処理用のキュー
-audio_queue = asyncio.Queue()
-segment_queue = asyncio.Queue()
-sound_queue = asyncio.Queue()
-
-# モデルとトークナイザーをロード
-onnx_bert_models.load_model(
-    language=Languages.JP,
-    pretrained_model_name_or_path="tsukumijima/deberta-v2-large-japanese-char-wwm-onnx",
-    onnx_providers=onnx_providers,
-    cache_dir=str(custom_cache_dir),
-    revision="d701ec67708287b20d2063270f6b535e6eed09ab",
+# 発話が溜まった場合のまとめてデコード（BatchedInferencePipeline で1回のバッチとして処理する）
+STT_BATCH_MAX_SIZE = 8  # まとめてデコードする発話の最大数（1 で無効）
+STT_BATCH_MAX_WAIT = 0.05  # 既に溜まっている場合に、さらに到着を待つ最大時間（秒）
+
+# ストリーミング文字起こし（発話中に再デコードし、確定した部分から先にTTSへ送る）
+STREAMING_STT = True
+STREAMING_INTERVAL = 1.0  # 発話中に再デコードする間隔（秒）
+
+# 音声合成の分割設定（文・節ごとに合成し、先頭のチャンクから再生を始める）
+MIN_CLAUSE_LENGTH = 10  # 「、」で区切る最小の文字数
+CHUNK_FADE_DURATION = 0.005  # チャンクのつなぎ目のフェード時間（秒）
+
+# セグメントが溜まった場合のまとめて合成（1回の infer で合成し、文字数の比率で元のセグメントに切り分ける）
+TTS_MERGE_MAX_SEGMENTS = 4  # まとめて合成するセグメントの最大数（1 で無効）
+TTS_MERGE_MAX_CHARS = 120  # まとめて合成する文字数の上限
+TTS_SPLIT_SEARCH = 0.2  # 切り分け位置を音量の小さい点へずらす範囲（秒）
+
+# 音声合成のパラメータ（tts_model.infer に渡す。キャッシュのキーにも含まれる）
+TTS_PARAMS = {}
+
+# 話し始めたら、それより前の発話の合成・再生を打ち切る（バージイン）
+BARGE_IN = True
+BARGE_IN_FADE_DURATION = 0.01  # 再生中の音声をフェードアウトする時間（秒）
+
+# 再生のタイミング（各セグメントを「発話された時刻 + PLAYOUT_TARGET_LAG」に再生し、元の「間」を保つ）
+PLAYOUT_TARGET_LAG = 1.0  # 話者に対する再生の遅れの目標（秒）
+PLAYOUT_MIN_GAP = 0.1  # 目標より遅れている場合に、セグメント間の「間」を詰める長さ（秒）
+
+# キューの長さの上限（一杯の間は上流が待たされる。録音コールバックからの投入は捨てられる）
+STAGE_QUEUE_SIZES = {"audio": 32, "segment": 16, "sound": 16}
+# 発話されてから再生されるまでの遅延の上限（秒、None で無効）。超えたセグメントは LOAD_SHEDDING_POLICY で処理する
+LATENCY_BUDGET = 10.0
+# "drop": 古いセグメント・音声を捨てる / "merge": 溜まっているセグメントを1つにまとめて合成する
+# "degrade": 「間」を詰め、DEGRADED_TTS_PARAMS（速い話速など）で上書きしたパラメータで合成する
+LOAD_SHEDDING_POLICY = "drop"
+DEGRADED_TTS_PARAMS = {"length": 0.8}  # tts_model.infer の length は小さいほど速く話す
+
+# 負荷に応じた品質の切り替え（直近の RTF や待っている件数が上限を超えた状態が続くと、軽い設定に切り替える）
+ADAPTIVE_QUALITY = True
+QUALITY_RTF_HIGH = 0.8  # STT・TTS の直近の RTF の上限
+QUALITY_RTF_LOW = 0.5  # 元の設定に戻す RTF
+QUALITY_QUEUE_HIGH = 4  # 待っている発話・セグメントの数の上限
+QUALITY_HOLD = 2.0  # 上限を超えた状態がこの時間（秒）続いたら切り替える
+QUALITY_COOLDOWN = 10.0  # 負荷が下がった状態がこの時間（秒）続いたら元に戻す
+# 負荷が高い間の設定
+FAST_WHISPER_MODEL = "small"  # 軽い Whisper のモデル（負荷が上がり始めた時点でロードする。None で切り替えない）
+FAST_WHISPER_OPTIONS = {"beam_size": 1, "temperature": [0.0]}  # 貪欲法でデコードする
+# sdp_ratio を下げ、少し速く話す。line_split=False と文・節への分割の省略で BERT の実行回数を減らす
+FAST_TTS_PARAMS = {"sdp_ratio": 0.0, "length": 0.9, "line_split": False}
+
+# 合成済み音声のキャッシュ
+TTS_CACHE_MAX_BYTES = 64 * 1024 * 1024  # メモリ上のキャッシュの上限（バイト）
+TTS_CACHE_DIR = "models/tts_cache"  # ディスク上のキャッシュの保存先（None で無効）
+TTS_CACHE_DISK_MAX_BYTES = 512 * 1024 * 1024  # ディスク上のキャッシュの上限（バイト）。超えると最終利用の古いものから消す
+
+# 起動時にダミーの音声・文で各モデルを実行し、最初の発話から温まった状態で処理する
+WARMUP = True
+
+# 推論・再生を実行するワーカー（"thread" または "process"）
+# "process" の場合、ワーカープロセスごとに必要なモデルがロードされるためメモリ使用量が増えます
+EXECUTORS = {
+    "stt": ("thread", 1),
+    "tts": ("thread", 1),
+}
+
+# メトリクスの公開設定
+METRICS_PORT = 9105  # localhost の /metrics で Prometheus 形式で公開するポート（None で無効）
+METRICS_JSON_PATH = "metrics.json"  # 定期的に JSON で書き出すファイル（None で無効）
+METRICS_JSON_INTERVAL = 10.0  # JSON を書き出す間隔（秒）
+RTF_SMOOTHING = 0.2  # 直近の RTF（指数移動平均）の平滑化係数
+
+# 発話ごとのトレース（Chrome / Perfetto 形式）
+# 終了時にトレースを書き出すファイル（例: "trace.json"。None で無効）
+# 記録中のスパンはメモリに溜まるため、計測する時だけ有効にする（上限を超えると古いスパンから捨てる）
+TRACE_PATH = None
+PROFILE_STAGE = None  # cProfile で計測するワーカー（"stt" または "tts"。スレッドワーカーのみ）
+PROFILE_PATH = "profile_{stage}.prof"  # cProfile の結果の保存先
+
+# メトリクス
+CAPTURE_TO_STT = Histogram("capture_to_stt_seconds", "Time from the end of an utterance being captured to its STT starting")
+STT_LATENCY = Histogram("stt_latency_seconds", "Whisper decode time per request")
+STT_BATCH_SIZE = Histogram("stt_batch_size", "Utterances decoded together in one Whisper batch", buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+TTS_LATENCY = Histogram("tts_latency_seconds", "Style-Bert-VITS2 synthesis time per chunk")
+PLAYBACK_LATENCY = Histogram("playback_latency_seconds", "Time from a synthesized chunk being ready to its playback starting, excluding the inter-segment gap")
+TIME_TO_FIRST_AUDIO = Histogram("time_to_first_audio_seconds", "Time from TTS start to playback start of the first chunk of a segment")
+STT_RTF = Histogram("stt_rtf", "Whisper real-time factor (decode time / audio duration)", buckets=RTF_BUCKETS)
+TTS_INFER_CALLS = Counter("tts_infer_calls", "tts_model.infer calls (each runs the BERT and VITS ONNX sessions once)")
+TTS_OUTPUT_SECONDS = Counter("tts_output_seconds", "Seconds of synthesized audio")
+TTS_INFER_CALLS_PER_SECOND = Gauge("tts_infer_calls_per_output_second", "tts_model.infer calls per second of synthesized audio")
+TTS_RTF = Histogram("tts_rtf", "TTS real-time factor (synthesis time / output duration)", buckets=RTF_BUCKETS)
+RECENT_RTF = Gauge("recent_rtf", "Exponential moving average of the real-time factor (STT: decode time needed to finish each utterance)", ("stage",))
+DROPPED_FRAMES = Counter("dropped_frames", "Captured frames lost before reaching STT", ("reason",))
+BARGE_IN_SILENCE = Histogram("barge_in_silence_seconds", "Time from a new speech onset to the previous output going silent")
+EXECUTOR_OVERLAP_GAIN = Gauge("executor_overlap_gain", "Sum of worker busy time over wall time with any worker busy")
+TTS_CACHE_EVENTS = Counter("tts_cache_events", "TTS cache lookups by result", ("result",))
+
+# 録音データは事前確保したリングバッファへ直接書き込む
+audio_ring = RingBuffer(int(RING_BUFFER_DURATION * STT_SAMPLERATE))
+
+# リングバッファ上の位置と録音時刻の対応（コールバックごとに更新）
+capture_clock = (0, time.perf_counter())
+# 入力が実時間で流れているか。ファイルを実時間より速く流す場合は、録音は処理より大きく先行するため、
+# STTが受け取った時点でその音声を録音したものとして対応を合わせる（仮想的な録音時刻。anchor_capture_clock を参照）
+realtime_capture = True
+next_partial_pos = 0  # 次に途中デコードを要求する位置
+
+# 録音レートが16kHzでない場合に、ブロック単位で16kHzへ変換するストリーミングリサンプラー
+capture_resampler = None
+
+# 発話中のストリーミング文字起こし
+streaming = None
+
+# まとめてデコードする場合の faster-whisper のパイプライン（モデル名ごと。STTワーカー上で作成する）
+batched_pipelines = {}
+
+# 発話ごとのトレース
+tracer = Tracer(enabled=TRACE_PATH is not None)
+current_trace_id = None  # 録音中の発話のトレース ID（発話の通し番号を兼ねる）
+
+# バージインで打ち切る境界（これより前の発話の作業・出力は捨てる）
+barge_in_id = 0
+
+# 発話区間検出
+vad = VadSegmenter(
+    STT_SAMPLERATE,
+    threshold=THRESHOLD,
+    noise_ratio=NOISE_RATIO,
+    onset_duration=ONSET_DURATION,
+    end_of_speech=END_OF_SPEECH_DURATION,
+    pre_roll=PRE_ROLL_DURATION,
+    post_roll=POST_ROLL_DURATION,
+    max_duration=MAX_RECORDING_DURATION,
 )
-onnx_bert_models.load_tokenizer(
-    language=Languages.JP,
-    pretrained_model_name_or_path="tsukumijima/deberta-v2-large-japanese-char-wwm-onnx",
-    cache_dir=str(custom_cache_dir),
-    revision="d701ec67708287b20d2063270f6b535e6eed09ab",
-)
-print("bert_model, bert_tokenizer loaded")
-
-with open(aivmx_path, mode="rb") as file:
-    aivm_metadata = aivmlib.read_aivmx_metadata(file)
-
-hyper_parameters = HyperParameters.model_validate(
-    aivm_metadata.hyper_parameters.model_dump()
-)
-
-style_vectors = np.load(BytesIO(aivm_metadata.style_vectors))
 
-aivm_manifest = aivm_metadata.manifest
-
-print("aivm metadata loaded:", aivm_manifest.uuid)
+# モデルのロード
+# 各モデルは起動時にバックグラウンドスレッドで並行してロードし、使う時点で完了を待つ
+def load_whisper_model():
+    """Whisperモデルのロード"""
+    # whisper_model = whisper.load_model("turbo", download_root=custom_cache_dir)  # 必要に応じてモデルサイズを変更可能
+    # asteroid_model = BaseModel.from_pretrained("mpariente/DPRNNTasNet-ks2_WHAM_sepclean", device=device, cache_dir=custom_cache_dir)
+    with cpu_budget.pinned("stt"):
+        return WhisperModel(
+            WHISPER_MODEL, download_root=custom_cache_dir,
+            compute_type=whisper_compute_type, cpu_threads=cpu_budget.threads("stt"),
+        )
+
+def load_fast_whisper_model():
+    """負荷が高い間に使う軽いWhisperモデルのロード"""
+    with cpu_budget.pinned("stt"):
+        return WhisperModel(
+            FAST_WHISPER_MODEL, download_root=custom_cache_dir,
+            compute_type=whisper_compute_type, cpu_threads=cpu_budget.threads("stt"),
+        )
+
+def load_bert_model():
+    """BERTモデルとトークナイザーをロード"""
+    config = cpu_budget.ort_options("bert", ORT_SESSION_OPTIONS["bert"])
+    with cpu_budget.pinned("bert"), session_profile(config, cache_path(ORT_CACHE_DIR, "bert", BERT_MODEL_REVISION[:12], config)):
+        onnx_bert_models.load_model(
+            language=Languages.JP,
+            pretrained_model_name_or_path=BERT_MODEL_NAME,
+            onnx_providers=onnx_providers,
+            cache_dir=str(custom_cache_dir),
+            revision=BERT_MODEL_REVISION,
+        )
+    onnx_bert_models.load_tokenizer(
+        language=Languages.JP,
+        pretrained_model_name_or_path=BERT_MODEL_NAME,
+        cache_dir=str(custom_cache_dir),
+        revision=BERT_MODEL_REVISION,
+    )
+    print("bert_model, bert_tokenizer loaded")
+    return onnx_bert_models
+
+def load_aivm_metadata():
+    """AIVMXファイルのメタデータをロード"""
+    with open(aivmx_path, mode="rb") as file:
+        aivm_metadata = aivmlib.read_aivmx_metadata(file)
+    print("aivm metadata loaded:", aivm_metadata.manifest.uuid)
+    return aivm_metadata
+
+def load_tts_model():
+    """音声合成モデルのロード"""
+    aivm_metadata = models.get("aivm_metadata")
+
+    hyper_parameters = HyperParameters.model_validate(
+        aivm_metadata.hyper_parameters.model_dump()
+    )
 
-tts_model = TTSModel(
-    # 音声合成モデルのパスとして、AIVMX ファイル (ONNX 互換) のパスを指定
-    model_path=aivmx_path,
-    # config_path とあるが、HyperParameters の Pydantic モデルを直接指定できる
-    config_path=hyper_parameters,
-    # style_vec_path とあるが、style_vectors の NDArray を直接指定できる
-    style_vec_path=style_vectors,
-    # ONNX 推論で利用する ExecutionProvider を指定
-    onnx_providers=onnx_providers,
-)
+    style_vectors = np.load(BytesIO(aivm_metadata.style_vectors))
+
+    tts_model = TTSModel(
+        # 音声合成モデルのパスとして、AIVMX ファイル (ONNX 互換) のパスを指定
+        model_path=aivmx_path,
+        # config_path とあるが、HyperParameters の Pydantic モデルを直接指定できる
+        config_path=hyper_parameters,
+        # style_vec_path とあるが、style_vectors の NDArray を直接指定できる
+        style_vec_path=style_vectors,
+        # ONNX 推論で利用する ExecutionProvider を指定
+        onnx_providers=onnx_providers,
+    )
 
-tts_model.load()
+    # 最適化済みモデルは AIVMX の UUID ごとにキャッシュする
+    config = cpu_budget.ort_options("tts", ORT_SESSION_OPTIONS["tts"])
+    with cpu_budget.pinned("tts"), session_profile(config, cache_path(ORT_CACHE_DIR, "tts", aivm_metadata.manifest.uuid, config)):
+        tts_model.load()
+    return tts_model
+
+def warmup_whisper_model(whisper_model):
+    """Whisperのウォームアップ（ストリーミング時は単語タイムスタンプの経路も通す）"""
+    return warmup_whisper(whisper_model, STT_SAMPLERATE, **whisper_options, word_timestamps=STREAMING_STT)
+
+def warmup_tts_model(tts_model):
+    """音声合成のウォームアップ（BERTモデルも合わせて温める）"""
+    models.get("bert")
+    style = models.get("aivm_metadata").manifest.speakers[0].styles[0].name
+    return warmup_tts(tts_model, style, TTS_PARAMS)
+
+cpu_budget = CpuBudget.from_env(CPU_BUDGET, CPU_AFFINITY)
+whisper_compute_type, whisper_options = load_whisper_config(WHISPER_CONFIG_PATH, WHISPER_MODEL)
+
+models = ModelRegistry()
+models.register("whisper", load_whisper_model, warmup_whisper_model if WARMUP else None)
+models.register("bert", load_bert_model)
+models.register("aivm_metadata", load_aivm_metadata)
+models.register("tts", load_tts_model, warmup_tts_model if WARMUP else None)
+if FAST_WHISPER_MODEL:
+    models.register("whisper_fast", load_fast_whisper_model, warmup_whisper_model if WARMUP else None, lazy=True)
 
 # 録音コールバック
-def audio_callback(indata, frames, time, status):
-    global recording, audio_buffer, silence_counter
+def audio_callback(indata, frames, time_info, status):
+    global capture_clock, next_partial_pos, current_trace_id
 
     if status:
         print(f"Stream status: {status}")
-
-    # 入力音声の音量を計算
-    rms = np.sqrt(np.mean(indata**2))
-    if recording:
-        audio_buffer.append(indata.copy())
-        if rms < THRESHOLD:
-            silence_counter += 1
-            if silence_counter * BLOCKSIZE / SAMPLERATE > SILENCE_DURATION:
-                recording = False
-                print("Silence detected. Stopping recording.")
-        else:
-            silence_counter = 0
+        if status.input_overflow:
+            DROPPED_FRAMES.labels("input_overflow").inc(frames)
+
+    block = indata[:, 0]
+    if capture_resampler is not None:
+        # ブロックごとに16kHzへ変換する（フィルタの状態はブロック間で引き継がれる）
+        resample_start_time = time.perf_counter()
+        block = capture_resampler.resample_chunk(block)
+        if vad.in_speech:
+            tracer.add_span("capture.resample", resample_start_time, time.perf_counter(), current_trace_id, "capture")
+        if len(block) == 0:
+            return
+
+    block_start = audio_ring.write_pos
+    # 入力音声はそのままリングバッファへ書き込む
+    audio_ring.write(block)
+    written = (audio_ring.write_pos, time.perf_counter())
+    if realtime_capture:
+        capture_clock = written
+
+    # フレーム単位で発話区間を検出
+    event = vad.process(block, block_start)
+    if event is None:
+        # 発話中は一定間隔で途中デコードを要求する（STTが追いついていない間は要求しない）
+        if STREAMING_STT and vad.in_speech and audio_ring.write_pos >= next_partial_pos and audio_stage.queue.empty():
+            audio_stage.put_threadsafe(PARTIAL, vad.speech_start, audio_ring.write_pos, trace_id=current_trace_id)
+            next_partial_pos = audio_ring.write_pos + int(STREAMING_INTERVAL * STT_SAMPLERATE)
+        return
+    kind, start, end = event
+    if kind == SPEECH_START:
+        print("Sound detected. Starting recording.")
+        current_trace_id = tracer.new_trace_id()
+        # 長い発話を強制的に区切った続きの場合は、前半の合成・再生を止めない
+        if BARGE_IN and not vad.continuation:
+            audio_stage.loop.call_soon_threadsafe(barge_in, current_trace_id, time.perf_counter())
+        next_partial_pos = audio_ring.write_pos + int(STREAMING_INTERVAL * STT_SAMPLERATE)
+    elif kind == SPEECH_END:
+        print("Silence detected. Stopping recording.")
+        tracer.add_span("capture.utterance", capture_time(start, written), capture_time(end, written), current_trace_id, "capture")
+        # 録音区間の位置だけを STT ステージへ通知する
+        audio_stage.put_threadsafe(SPEECH_END, start, end, trace_id=current_trace_id)
+        print("Listening...")
+
+def interrupted(trace_id):
+    """バージインで打ち切られた発話の作業か"""
+    return BARGE_IN and trace_id is not None and trace_id < barge_in_id
+
+def barge_in(trace_id, onset_time):
+    """新しい発話が始まった時に、それより前の発話の作業をすべて捨て、再生中の音声を止める（イベントループ上で実行）
+
+    計算資源は常に最新の発話に回す。まだ文字起こししていない前の発話の録音も捨て、
+    処理中の文字起こし・合成の結果も再生しない（STTが遅れている時に古い発話が新しい発話に重ならないように）。
+    そのため BARGE_IN が有効な間は、溜まった発話のまとめてデコードは強制的に区切った長い発話の続きにだけ働く。
+    """
+    global barge_in_id
+    barge_in_id = trace_id
+    for stage in (audio_stage, segment_stage, sound_stage):
+        discarded = stage.discard(lambda item_trace_id, item: interrupted(item_trace_id))
+        if discarded:
+            SHED_ITEMS.labels(stage.name, "barge_in").inc(discarded)
+    asyncio.create_task(silence_output(onset_time))
+
+async def silence_output(onset_time):
+    silent_at = await audio_output.interrupt(BARGE_IN_FADE_DURATION)
+    playout.reset()
+    if silent_at is not None:
+        BARGE_IN_SILENCE.observe(silent_at - onset_time)
+        print(f"Barge-in: output silenced {(silent_at - onset_time) * 1000:.0f}ms after speech onset")
+
+def capture_time(pos, clock=None):
+    """リングバッファ上の位置を、その音声が録音された時刻（perf_counter）に変換する"""
+    ref_pos, ref_time = clock or capture_clock
+    return ref_time - (ref_pos - pos) / STT_SAMPLERATE
+
+def anchor_capture_clock(pos, received_time=None):
+    """実時間より速い入力の場合に、pos までの音声を received_time（既定は現在）に録音し終えたものとして録音時刻を合わせる
+
+    STTが区間を受け取った時点で呼ぶ。区間の中の時刻はサンプルレートどおりに進むため「間」は保たれ、
+    遅延の上限・再生のタイミングはSTTが受け取ってからの処理の遅れに対して働く。
+    """
+    global capture_clock
+    if not realtime_capture:
+        capture_clock = (pos, received_time or time.perf_counter())
+
+# 音声処理
+async def process_audio(kind, start, end, trace_id=None):
+    """リングバッファ上の録音区間をコピーせずにSTT処理に渡す"""
+    if kind == PARTIAL and audio_stage.queue.qsize() > 0:
+        # 後続の要求が溜まっている場合、古い途中デコードは省略する
+        return
+    if interrupted(trace_id):
+        SHED_ITEMS.labels("audio", "barge_in").inc()
+        return
+    print("Processing audio...")
+    start = valid_start(start, end)
+    if start is None:
+        return
+    anchor_capture_clock(end)
+    # 仮想的な録音時刻では待ち時間は常に 0 になるため、実時間の入力の場合だけ記録する
+    if kind == SPEECH_END and realtime_capture:
+        CAPTURE_TO_STT.observe(time.perf_counter() - capture_time(end))
+
+    # STTモデルのロードが終わるまでは、録音区間の位置だけをキューに溜めておく
+    if not models.is_ready("whisper"):
+        print("Waiting for the Whisper model to be loaded...")
+        await models.wait("whisper")
+
+    # 後続の発話が溜まっている場合は、まとめて1回のバッチでデコードする
+    # （ストリーミング中の発話は確定済みの単語があるため、通常どおり処理する）
+    streaming_active = streaming is not None and streaming.utterance_start == start
+    if kind == SPEECH_END and STT_BATCH_MAX_SIZE > 1 and not streaming_active and queued_speech_ends():
+        await process_whisper_batch([(trace_id, start, end)])
+        return
+
+    # STT処理
+    # ここでfaster-whisperを使用したSTT処理を行います
+    if STREAMING_STT:
+        await process_whisper_streaming(kind, start, end, trace_id)
     else:
-        if rms >= THRESHOLD:
-            recording = True
-            audio_buffer = [indata.copy()]
-            silence_counter = 0
-            print("Sound detected. Starting recording.")
-
-# 非同期で音声処理
-async def process_audio_task():
-    while True:
-        if not audio_queue.empty():
-            start_time = time.time()
-            audio_data = await audio_queue.get()
-            print("Processing audio...")
-
-            # STT処理
-            # ここでfaster-whisperを使用したSTT処理を行います
-            await process_whisper(audio_data)
-
-            exec_time = time.time() - start_time
-            print("Process audio exec time:", exec_time)
-
-        await asyncio.sleep(0.1)  # キューが空の場合の待機
-
-async def process_segment_task():
-    while True:
-        if not segment_queue.empty():
-            start_time = time.time()
-            text, delay = await segment_queue.get()
-            print("Processing segment...")
-
-            # TTS処理
-            # ここでStyleBertVITS2を使用したSTT処理を行います
-            await process_tts(text, delay)
-
-            exec_time = time.time() - start_time
-            print("Process segment exec time:", exec_time)
-
-        await asyncio.sleep(0.1)  # キューが空の場合の待機
-
-async def process_sound_task():
-    while True:
-        if not sound_queue.empty():
-            start_time = time.time()
-            audio, sr, delay = await sound_queue.get()
-            print("Processing sound...")
-
-            # サウンド処理
-            # ここでサウンド処理を行います
-            await asyncio.sleep(delay) # セグメント間の「間」を取る。
-            await process_sound(audio, sr)
-
-            exec_time = time.time() - start_time
-            print("Process sound exec time:", exec_time)
-
-        await asyncio.sleep(0.1)  # キューが空の場合の待機
+        await process_whisper(audio_ring.view(start, end), trace_id, capture_time(start))
+
+def capture_ready():
+    """録音を先へ進めてよいか（ファイル入力を実時間より速く流す場合の背圧。録音スレッドから呼ぶ）
+
+    まだ文字起こししていない最も古い位置から、リングバッファの残りが CAPTURE_HEADROOM 秒を切るまで
+    書き込んだ場合や、STTのキューが半分以上埋まっている場合は、処理が追いつくまで待たせる。
+    """
+    starts = []
+    oldest = audio_stage.oldest()
+    if oldest is not None:
+        starts.append(oldest[1])
+    if vad.in_speech:
+        starts.append(vad.speech_start)
+    needed_from = min(starts, default=audio_ring.write_pos)
+    headroom = audio_ring.capacity - (audio_ring.write_pos - needed_from)
+    return headroom > CAPTURE_HEADROOM * STT_SAMPLERATE and not audio_stage.nearly_full()
+
+def queued_speech_ends():
+    """キューに溜まっている発話終了の数"""
+    return sum(kind == SPEECH_END for kind, _, _ in audio_stage.pending())
+
+def valid_start(start, end):
+    """pre-roll がリングバッファから溢れている場合は残っている範囲の開始位置を返す（すべて上書き済みなら None）"""
+    start = max(start, audio_ring.oldest_pos())
+    if not audio_ring.is_valid(start) or start >= end:
+        print("Recorded audio was overwritten before processing. Skipped.")
+        DROPPED_FRAMES.labels("ring_overrun").inc(max(end - start, 0))
+        return None
+    return start
+
+# サウンド処理
+async def process_sound_item(audio, sr, source_start, ready_time, tts_start_time=None, origin=None, trace_id=None):
+    """発話時刻に合わせた再生時刻まで待ってから音声を再生する
+
+    source_start・origin はセグメントの発話の開始・終了時刻（perf_counter）。
+    source_start が None の場合は前のクリップに続けて再生する。
+    """
+    if over_latency_budget(origin) and LOAD_SHEDDING_POLICY == "drop":
+        print("Synthesized voice is too late. Dropped.")
+        SHED_ITEMS.labels("sound", "stale").inc()
+        return
+    print("Processing sound...")
+    # 元の発話のタイムラインに合わせて「間」を取る
+    scheduled_wait = await playout.wait(source_start, origin if source_start is not None else None)
+    if interrupted(trace_id):
+        SHED_ITEMS.labels("sound", "barge_in").inc()
+        return
+    PLAYBACK_LATENCY.observe(time.perf_counter() - ready_time - scheduled_wait)
+    if tts_start_time is not None:
+        # セグメントの先頭チャンクの場合、TTS開始から再生開始までの時間（「間」を除く）を記録
+        first_audio_time = time.perf_counter() - tts_start_time - scheduled_wait
+        TIME_TO_FIRST_AUDIO.observe(first_audio_time)
+        print("Time to first audio: %.2fs" % first_audio_time)
+    with tracer.span("playback", trace_id, "playback", duration=len(audio) / sr):
+        await process_sound(audio, sr)
+    playout.finished()
+    executors.report()
 
 # メイン処理
 async def main():
-    global audio_buffer
+    global capture_resampler, audio_output, realtime_capture
+
+    print(cpu_budget.describe())
+    # 全モデルのロードをバックグラウンドで一斉に開始し、ロードを待たずに録音を始める
+    models.start()
+
+    # 各ステージを開始してから入力ストリームを開く
+    stages = (audio_stage, segment_stage, sound_stage)
+    for stage in stages:
+        stage.start()
+
+    if TRACE_PATH and not instrument_bert(tracer):
+        print("BERT feature extraction could not be instrumented; tracing TTS as a whole.")
+    if PROFILE_STAGE:
+        executors.profilers[PROFILE_STAGE] = StageProfiler()
+
+    if METRICS_PORT:
+        REGISTRY.serve(METRICS_PORT)
+    if METRICS_JSON_PATH:
+        asyncio.create_task(REGISTRY.dump_json_periodically(METRICS_JSON_PATH, METRICS_JSON_INTERVAL))
+    if ADAPTIVE_QUALITY:
+        asyncio.create_task(quality.run())
+
+    audio_output = create_output(output_configs)
+    # 入力が16kHzで録音できればそのまま使い、できなければSAMPLERATEで録音して変換する
+    audio_input = create_input(input_config, STT_SAMPLERATE, SAMPLERATE, CHANNELS)
+    capture_samplerate = audio_input.samplerate
+    realtime_capture = audio_input.realtime
+    if capture_samplerate != STT_SAMPLERATE:
+        capture_resampler = soxr.ResampleStream(capture_samplerate, STT_SAMPLERATE, CHANNELS, dtype='float32')
+    print(f"Capturing at {capture_samplerate} Hz")
+    blocksize = round(BLOCKSIZE * capture_samplerate / SAMPLERATE)
 
-    # 音声入力ストリームを非同期で監視
     print("Listening...")
-    with sd.InputStream(device=MIC_DEVICE, samplerate=SAMPLERATE, channels=CHANNELS, callback=audio_callback, blocksize=BLOCKSIZE, dtype='float32'):
+    with audio_input.open(audio_callback, blocksize, capture_ready):
         try:
-            # 録音処理と並行して音声処理を実行
-            _ = asyncio.create_task(process_audio_task())
-            # 録音処理と並行してセグメント処理を実行
-            _ = asyncio.create_task(process_segment_task())
-            # 録音処理と並行してサウンド処理を実行
-            _ = asyncio.create_task(process_sound_task())
-
-            while True:
-                if not recording and len(audio_buffer) > 0:
-                    audio_data = np.concatenate(audio_buffer, axis=0).flatten()
-                    await audio_queue.put(audio_data)  # キューにデータを追加
-                    audio_buffer = []  # バッファをリセット
-                    print("Listening...")
-
-                await asyncio.sleep(0.1)  # メインループの待機
+            # 各ステージは作業が届いた時点で起きるため、ここではポーリングしない
+            await audio_input.wait()
+            # ファイル入力が終わった場合は、残っている作業を処理し終えてから終了する
+            print("Input finished. Waiting for the pipeline to drain...")
+            for stage in stages:
+                await stage.queue.join()
         except KeyboardInterrupt:
             print("Stopped by user.")
+        finally:
+            executors.shutdown()
+            audio_output.close()
+            tts_cache.close()
+            if TRACE_PATH:
+                tracer.export(TRACE_PATH)
+            for stage, profiler in executors.profilers.items():
+                profiler.dump(PROFILE_PATH.format(stage=stage))
 
 # STT処理関数
-async def process_whisper(audio_data):
-    """音声データを文字列セグメントに変換するSTT処理"""
-    # Whisperで文字起こし
-    print("Transcribing the loudest source with Whisper...")
-    resampled_audio = librosa.resample(audio_data, orig_sr=SAMPLERATE, target_sr=16000)
-
-    segments, _ = whisper_model.transcribe(resampled_audio, language="ja")
-    # フィルタリング処理
+def whisper_setting():
+    """現在の品質で使う (モデル名, デコード設定) を返す（軽いモデルはロード済みの場合だけ使う）"""
+    if not quality.degraded:
+        return "whisper", whisper_options
+    name = "whisper_fast" if FAST_WHISPER_MODEL and models.is_ready("whisper_fast") else "whisper"
+    return name, {**whisper_options, **FAST_WHISPER_OPTIONS}
+
+def transcribe(audio_data, whisper=None, **options):
+    """Whisperで文字起こしし、信頼スコアでフィルタリングしたセグメントを返す（ワーカー上で実行）
+
+    whisper は使う (モデル名, デコード設定)。省略時は現在の品質の設定を使う。
+    """
+    # audio_data は録音時点で16kHzに変換済み
+    name, setting = whisper or whisper_setting()
+    whisper_model = models.get(name)
+    segments, _ = whisper_model.transcribe(audio_data, language="ja", **{**setting, **options})
+    # フィルタリング処理（ジェネレーターの消費もワーカー上で行う）
     filtered_segments = []
     for segment in segments:
         if segment.avg_logprob >= AVG_LOGPROB_THRESHOLD and segment.no_speech_prob <= NO_SPEECH_PROB_THRESHOLD:
             filtered_segments.append(segment)
-    
+    return filtered_segments
+
+def record_rtf(histogram, stage, elapsed, audio_duration, recent=True):
+    """実時間係数を記録する（recent=True の場合は直近の値として指数移動平均にも反映する）"""
+    if audio_duration <= 0:
+        return
+    rtf = elapsed / audio_duration
+    histogram.observe(rtf)
+    if recent:
+        record_recent_rtf(stage, rtf)
+
+def record_recent_rtf(stage, rtf):
+    """直近の実時間係数（品質の切り替えに使う指数移動平均）を更新する"""
+    recent = RECENT_RTF.labels(stage)
+    recent.set(rtf if recent.get() == 0 else recent.get() + (rtf - recent.get()) * RTF_SMOOTHING)
+
+async def run_stt(audio_data, trace_id=None, utterance_duration=None, **options):
+    """ワーカーで文字起こしを実行し、レイテンシと実時間係数を記録する
+
+    utterance_duration は、このデコードで処理し終える発話の長さ（秒）。発話の途中の再デコードは None にする。
+    Whisper は短い窓も30秒分に埋めてデコードするため、途中の再デコードの実時間係数は処理が追いついていても
+    1 近くになる。直近の実時間係数（品質の切り替えの判断に使う）は、発話を処理し終えるデコードの時間を
+    発話全体の長さで割った値だけで更新する。
+    """
+    start_time = time.perf_counter()
+    segments = await executors.run("stt", transcribe, audio_data, **options)
+    elapsed = time.perf_counter() - start_time
+    tracer.add_span("stt.decode", start_time, start_time + elapsed, trace_id, "stt", audio_duration=len(audio_data) / STT_SAMPLERATE)
+    STT_LATENCY.observe(elapsed)
+    record_rtf(STT_RTF, "stt", elapsed, len(audio_data) / STT_SAMPLERATE, recent=False)
+    if utterance_duration:
+        record_recent_rtf("stt", elapsed / utterance_duration)
+    return segments
+
+def transcribe_batch(clips):
+    """複数の発話を1回のバッチで文字起こしし、発話ごとのセグメントのリストを返す（ワーカー上で実行）
+
+    発話をつなげた音声と各発話の区間（clip_timestamps）を BatchedInferencePipeline に渡す。
+    返すセグメントの時刻は各発話の先頭からの秒数に直す。
+    """
+    name, setting = whisper_setting()
+    if name not in batched_pipelines:
+        batched_pipelines[name] = BatchedInferencePipeline(model=models.get(name))
+
+    offsets = np.cumsum([0] + [len(clip) for clip in clips])
+    clip_timestamps = [{"start": int(offsets[i]), "end": int(offsets[i + 1])} for i in range(len(clips))]
+    segments, _ = batched_pipelines[name].transcribe(
+        np.concatenate(clips), language="ja", clip_timestamps=clip_timestamps, batch_size=len(clips),
+        **setting,
+    )
+    results = [[] for _ in clips]
+    for segment in segments:
+        if segment.avg_logprob < AVG_LOGPROB_THRESHOLD or segment.no_speech_prob > NO_SPEECH_PROB_THRESHOLD:
+            continue
+        # セグメントの中点が含まれる区間の発話に戻す
+        # （seek は区間の先頭を 10ms 単位に切り捨てた値のため、サンプル位置と比べると1つ前の区間になりうる）
+        midpoint = (segment.start + segment.end) / 2 * STT_SAMPLERATE
+        index = int(np.searchsorted(offsets, midpoint, side="right")) - 1
+        index = min(max(index, 0), len(clips) - 1)
+        offset = offsets[index] / STT_SAMPLERATE
+        results[index].append(dataclasses.replace(segment, start=segment.start - offset, end=segment.end - offset))
+    return results
+
+async def process_whisper_batch(batch):
+    """溜まっている発話を取り出してまとめてデコードし、発話の順にTTSへ送る
+
+    batch は (trace_id, start, end) のリストで、先頭はハンドラーが受け取った発話。
+    """
+    # キューにある発話終了を最大 STT_BATCH_MAX_SIZE - 1 件まで取り出す（間に挟まった途中デコードは古いため省略する）
+    count = 0
+    speech_ends = 0
+    for i, (kind, _, _) in enumerate(audio_stage.pending()):
+        if kind == SPEECH_END:
+            speech_ends += 1
+            count = i + 1
+            if speech_ends == STT_BATCH_MAX_SIZE - 1:
+                break
+    taken = await audio_stage.take(count)
+    # まだ余裕があれば、STT_BATCH_MAX_WAIT までは次の発話終了の到着を待つ
+    deadline = time.perf_counter() + STT_BATCH_MAX_WAIT
+    while 1 + speech_ends < STT_BATCH_MAX_SIZE:
+        arrived = await audio_stage.take(1, deadline - time.perf_counter())
+        if not arrived or arrived[0][1][0] != SPEECH_END:
+            # 途中デコードが届いた場合は待つのをやめる（次の途中デコードで追いつく）
+            taken += arrived
+            break
+        taken += arrived
+        speech_ends += 1
+
+    for trace_id, (kind, start, end) in taken:
+        if kind != SPEECH_END:
+            continue
+        start = valid_start(start, end)
+        if start is not None:
+            if realtime_capture:
+                CAPTURE_TO_STT.observe(time.perf_counter() - capture_time(end))
+            batch.append((trace_id, start, end))
+    received_time = time.perf_counter()
+
+    # 録音中に上書きされないよう、ワーカーに渡す前にコピーする
+    clips = [audio_ring.view(start, end).copy() for _, start, end in batch]
+    print(f"Transcribing {len(clips)} queued utterances in one batch with Whisper...")
+    start_time = time.perf_counter()
+    if len(clips) == 1:
+        results = [await executors.run("stt", transcribe, clips[0])]
+    else:
+        results = await executors.run("stt", transcribe_batch, clips)
+    elapsed = time.perf_counter() - start_time
+    audio_duration = sum(len(clip) for clip in clips) / STT_SAMPLERATE
+    for trace_id, _, _ in batch:
+        tracer.add_span("stt.decode", start_time, start_time + elapsed, trace_id, "stt", batch_size=len(clips))
+    STT_LATENCY.observe(elapsed)
+    STT_BATCH_SIZE.observe(len(clips))
+    record_rtf(STT_RTF, "stt", elapsed, audio_duration)
+
+    for (trace_id, start, end), segments in zip(batch, results):
+        # 実時間より速い入力では、まとめて受け取った発話もそれぞれ受け取った時点で録音し終えたものとする
+        anchor_capture_clock(end, received_time)
+        await push_segments(segments, trace_id, capture_time(start))
+
+async def process_whisper(audio_data, trace_id=None, utterance_time=None):
+    """音声データを文字列セグメントに変換するSTT処理"""
+    # Whisperで文字起こし
+    print("Transcribing the loudest source with Whisper...")
+    filtered_segments = await run_stt(audio_data, trace_id, len(audio_data) / STT_SAMPLERATE)
+    await push_segments(filtered_segments, trace_id, utterance_time)
+
+async def push_segments(filtered_segments, trace_id=None, utterance_time=None):
+    """文字起こししたセグメントを、元の発話の「間」を保ってTTSへ送る
+
+    utterance_time は発話の先頭が録音された時刻（perf_counter）で、各セグメントの発話時刻の基準になる。
+    """
     text = ""
-    delay_end = 0
     for segment in filtered_segments:
         print("[avg_logprob: %.2f, no_speech_prob: %.2f] %s" % (segment.avg_logprob, segment.no_speech_prob, segment.text))
         print("[%.2fs -> %.2fs] %s" % (segment.start, segment.end, segment.text))
-        delay = delay_end - segment.start
-        delay_end = segment.end
-        await segment_queue.put((segment.text, delay))
+        if utterance_time is not None:
+            source_start, origin = utterance_time + segment.start, utterance_time + segment.end
+        else:
+            source_start, origin = None, None
+        await segment_stage.put(segment.text, source_start, origin, trace_id=trace_id)
         text += segment.text
     print("Transcription:", text)
 
-# TTS処理関数
-async def process_tts(text, delay):
-    """文字列を音声に変換するTTS処理"""
-    print("Generateing Voice:", text)
-    sr, audio = tts_model.infer(
-        text=text,
-        style=aivm_manifest.speakers[0].styles[0].name,
+async def process_whisper_streaming(kind, start, end, trace_id=None):
+    """発話中の窓を再デコードし、確定した部分からTTSへ送るストリーミングSTT処理"""
+    global streaming
+
+    if streaming is None or streaming.utterance_start != start:
+        # 途中でモデルを切り替えると前回の仮説との比較（LocalAgreement）が成り立たないため、
+        # 品質が切り替わっても発話の終わりまでは開始時のモデル・設定を使う
+        streaming = StreamingTranscriber(start, STT_SAMPLERATE, whisper=whisper_setting())
+    final = kind == SPEECH_END
+    if not final and not streaming.should_decode(end):
+        return
+
+    window_start = max(streaming.window_start, start)
+    print("Transcribing %s window with Whisper..." % ("final" if final else "partial"))
+    segments = await run_stt(
+        audio_ring.view(window_start, end), trace_id, (end - start) / STT_SAMPLERATE if final else None,
+        whisper=streaming.whisper, word_timestamps=True, initial_prompt=streaming.prompt(),
     )
-    print("Generated Voice")
-    await sound_queue.put((audio, sr, delay))
+    committed = streaming.update(segments, window_start, capture_time, final=final)
+    if committed:
+        text = "".join(word.text for word in committed)
+        print("Committed:", text)
+        await segment_stage.put(
+            text, capture_time(committed[0].start), capture_time(committed[-1].end), trace_id=trace_id
+        )
+
+    if final:
+        print("Transcription:", streaming.committed_text)
+        streaming.report()
+        streaming = None
 
-async def play_on_device(audio, sr, device_id):
-    """指定したデバイスで音声を再生"""
-    sd.play(audio, samplerate=sr, device=device_id)
-    sd.wait()
+# TTS処理関数
+def synthesize(text, style, params, trace_id=None):
+    """文字列から音声を合成する（ワーカー上で実行）"""
+    # BERTモデルは合成時に使われるため、ロード完了を待ってから合成する
+    models.get("bert")
+    tts_model = models.get("tts")
+    start_time = time.perf_counter()
+    with tracer.context(trace_id), tracer.span("tts.synthesize", trace_id, "tts", text=text):
+        result = tts_model.infer(
+            text=text,
+            style=style,
+            **params,
+        )
+    # BERT 特徴量の抽出が記録できていれば、その後の VITS による合成部分を別のスパンとして記録する
+    bert_end = tracer.last_span_end("tts.bert_features")
+    if bert_end is not None and bert_end > start_time:
+        tracer.add_span("tts.vits_synthesis", bert_end, time.perf_counter(), trace_id, "tts")
+    return result
+
+def record_tts(elapsed, sr, audio):
+    """1回の合成のレイテンシ・実時間係数・出力秒数を記録する"""
+    TTS_LATENCY.observe(elapsed)
+    record_rtf(TTS_RTF, "tts", elapsed, len(audio) / sr)
+    TTS_INFER_CALLS.inc()
+    TTS_OUTPUT_SECONDS.inc(len(audio) / sr)
+
+def over_latency_budget(origin):
+    """発話されてから LATENCY_BUDGET 以上経っているか"""
+    return LATENCY_BUDGET is not None and origin is not None and time.perf_counter() - origin > LATENCY_BUDGET
+
+async def process_tts(text, source_start, origin=None, trace_id=None):
+    """文字列を文・節ごとのチャンクに分けて音声に変換するTTS処理
+
+    source_start・origin はセグメントの先頭・末尾が発話された時刻（perf_counter）。
+    再生のタイミングと遅延の上限の判定に使う。
+    """
+    if interrupted(trace_id):
+        SHED_ITEMS.labels("segment", "barge_in").inc()
+        return
+    tts_start_time = time.perf_counter()
+    aivm_manifest = (await models.wait("aivm_metadata")).manifest
+    style = aivm_manifest.speakers[0].styles[0].name
+    params = tts_params()
+
+    # 遅延の上限を超えている場合は、設定に応じて捨てる・まとめる・速くする
+    if over_latency_budget(origin):
+        print(f"Segment is {time.perf_counter() - origin:.1f}s behind the speaker ({LOAD_SHEDDING_POLICY}).")
+        if LOAD_SHEDDING_POLICY == "drop":
+            SHED_ITEMS.labels("segment", "stale").inc()
+            return
+        if LOAD_SHEDDING_POLICY == "merge":
+            # 溜まっているセグメントを文字数の上限まで1つにまとめ、「間」を取らずに続けて話す
+            texts = [text]
+            for _, (queued_text, _, queued_origin) in await segment_stage.take(mergeable_segments(len(text))):
+                texts.append(queued_text)
+                origin = queued_origin
+                SHED_ITEMS.labels("segment", "merged").inc()
+            text = "".join(map(merged_text, texts))
+        elif LOAD_SHEDDING_POLICY == "degrade":
+            params = {**params, **DEGRADED_TTS_PARAMS}
+            source_start = None
+            SHED_ITEMS.labels("segment", "degraded").inc()
+    # 後続のセグメントが溜まっている場合は、まとめて1回で合成する
+    elif TTS_MERGE_MAX_SEGMENTS > 1 and segment_stage.pending():
+        await process_tts_merged([(trace_id, text, source_start, origin)], aivm_manifest, style, tts_start_time)
+        return
+
+    # 負荷が高い間は分割せずに1回で合成する（BERT・VITS の実行回数を減らす）
+    chunks = [text] if quality.degraded else split_text(text, MIN_CLAUSE_LENGTH)
+    for i, chunk in enumerate(chunks):
+        # 同じ文言・モデル・スタイル・パラメータで合成済みなら合成を省略する
+        cache_key = tts_cache.make_key(chunk, aivm_manifest.uuid, style, params)
+        cached = await tts_cache.get_async(cache_key)
+        if cached is not None:
+            print("Cached Voice:", chunk)
+            sr, audio = cached
+        else:
+            print("Generateing Voice:", chunk)
+            synthesis_start_time = time.perf_counter()
+            sr, audio = await executors.run("tts", synthesize, chunk, style, params, trace_id)
+            record_tts(time.perf_counter() - synthesis_start_time, sr, audio)
+            tts_cache.put(cache_key, sr, audio)
+            print("Generated Voice")
+        # 合成中に新しい発話が始まった場合、合成結果は再生せず残りのチャンクも合成しない
+        if interrupted(trace_id):
+            SHED_ITEMS.labels("segment", "barge_in").inc()
+            break
+        # 合成できたチャンクから順に再生ステージへ送り、次のチャンクの合成と再生を並行させる
+        audio = fade_edges(audio, sr, CHUNK_FADE_DURATION)
+        if i == 0:
+            await sound_stage.put(audio, sr, source_start, time.perf_counter(), tts_start_time, origin, trace_id=trace_id)
+        else:
+            await sound_stage.put(audio, sr, None, time.perf_counter(), None, origin, trace_id=trace_id)
+    tts_cache.report()
+
+def tts_params():
+    """現在の品質で使う音声合成のパラメータ"""
+    return {**TTS_PARAMS, **FAST_TTS_PARAMS} if quality.degraded else TTS_PARAMS
+
+def mergeable_segments(chars, max_segments=None):
+    """溜まっているセグメントのうち、chars 文字に続けて TTS_MERGE_MAX_CHARS までにまとめられる数"""
+    count = 0
+    for text, _, _ in segment_stage.pending()[:max_segments]:
+        chars += len(text)
+        if chars > TTS_MERGE_MAX_CHARS:
+            break
+        count += 1
+    return count
+
+def merged_text(text):
+    """まとめて合成する際に、セグメントの切れ目が文の切れ目になるよう句点を補う"""
+    text = text.strip()
+    if text and text[-1] not in "。！？!?、，,」』）)":
+        text += "。"
+    return text
+
+async def process_tts_merged(batch, aivm_manifest, style, tts_start_time):
+    """溜まっているセグメントを取り出し、1回の infer で合成してからセグメントごとに切り分けて再生する
+
+    batch は (trace_id, text, source_start, origin) のリストで、先頭はハンドラーが受け取ったセグメント。
+    溜まっている時点で待ち時間が発生しているため、チャンク分割よりも合成回数の削減を優先する。
+    """
+    # 文字数の上限までのセグメントを取り出す
+    count = mergeable_segments(len(batch[0][1]), TTS_MERGE_MAX_SEGMENTS - 1)
+    for trace_id, (text, source_start, origin) in await segment_stage.take(count):
+        batch.append((trace_id, text, source_start, origin))
+
+    # 合成済みのセグメントはキャッシュを使い、残りをまとめて合成する
+    params = tts_params()
+    keys = [tts_cache.make_key(text, aivm_manifest.uuid, style, params) for _, text, _, _ in batch]
+    voices = [await tts_cache.get_async(key) for key in keys]
+    missing = [i for i, voice in enumerate(voices) if voice is None]
+    if missing:
+        texts = [merged_text(batch[i][1]) for i in missing]
+        print(f"Generateing Voice for {len(missing)} queued segments:", "".join(texts))
+        synthesis_start_time = time.perf_counter()
+        trace_id = batch[missing[0]][0]
+        sr, audio = await executors.run("tts", synthesize, "".join(texts), style, params, trace_id)
+        record_tts(time.perf_counter() - synthesis_start_time, sr, audio)
+        # 文字数の比率で切り分け位置を見積もり、近くの音量の小さい点で切る
+        ratios = np.cumsum([len(text) for text in texts])[:-1] / sum(len(text) for text in texts)
+        pieces = split_at_quiet_points(audio, sr, ratios, TTS_SPLIT_SEARCH)
+        # 切り分けた音声は前後の文脈込みで合成した推定の切れ目のため、単独の合成結果としてキャッシュしない
+        for i, piece in zip(missing, pieces):
+            voices[i] = (sr, piece)
+        print("Generated Voice")
+
+    for (trace_id, text, source_start, origin), (sr, audio) in zip(batch, voices):
+        if interrupted(trace_id):
+            SHED_ITEMS.labels("segment", "barge_in").inc()
+            continue
+        audio = fade_edges(audio, sr, CHUNK_FADE_DURATION)
+        # TTS開始から最初の音声までの時間は、最初に再生するクリップでだけ記録する
+        await sound_stage.put(audio, sr, source_start, time.perf_counter(), tts_start_time, origin, trace_id=trace_id)
+        tts_start_time = None
+    tts_cache.report()
 
 # サウンド処理関数
 async def process_sound(audio, sr):
     """音声を再生するサウンド処理"""
     print("Playing Sound...")
-    # 再生タスクを作成
-    tasks = [
-        play_on_device(audio, sr, MONITOR_DEVICE),
-        play_on_device(audio, sr, SPEEKER_DEVICE),
-    ]
-    # 並行して再生タスクを実行
-    await asyncio.gather(*tasks)
+    # 常駐している各デバイスのストリームへ同じ音声を送り、並行して再生する
+    await audio_output.play(audio, sr)
+
+# 処理用のステージ
+audio_stage = Stage("audio", process_audio, tracer, STAGE_QUEUE_SIZES["audio"])
+segment_stage = Stage("segment", process_tts, tracer, STAGE_QUEUE_SIZES["segment"])
+sound_stage = Stage("sound", process_sound_item, tracer, STAGE_QUEUE_SIZES["sound"])
+
+# 推論を行うワーカースレッドも、各エンジンに割り当てたコアに固定する
+executors = ExecutorLayer(EXECUTORS, {name: functools.partial(cpu_budget.pin_thread, name) for name in EXECUTORS})
+
+playout = PlayoutScheduler(PLAYOUT_TARGET_LAG, PLAYOUT_MIN_GAP)
+
+tts_cache = TTSCache(TTS_CACHE_MAX_BYTES, TTS_CACHE_DIR, TTS_CACHE_DISK_MAX_BYTES)
+
+# 負荷が上がり始めたら軽いWhisperのロードを始め、切り替えの時点で待たずに済むようにする
+quality = QualityController(
+    lambda: max(RECENT_RTF.labels("stt").get(), RECENT_RTF.labels("tts").get()),
+    lambda: queued_speech_ends() + len(segment_stage.pending()),
+    rtf_high=QUALITY_RTF_HIGH,
+    rtf_low=QUALITY_RTF_LOW,
+    depth_high=QUALITY_QUEUE_HIGH,
+    hold=QUALITY_HOLD,
+    cooldown=QUALITY_COOLDOWN,
+    on_pressure=(lambda: models.preload("whisper_fast")) if FAST_WHISPER_MODEL else None,
+)
+
+EXECUTOR_OVERLAP_GAIN.set_function(executors.overlap_gain)
+TTS_INFER_CALLS_PER_SECOND.set_function(
+    lambda: TTS_INFER_CALLS.labels().value / max(TTS_OUTPUT_SECONDS.labels().value, 1e-9)
+)
+for result in ("memory_hits", "disk_hits", "misses"):
+    TTS_CACHE_EVENTS.labels(result).set_function(lambda result=result: tts_cache.stats()[result])
+
+# 入出力の設定（出力はモニター・スピーカーなど、設定したすべての出力に同じ音声を再生する）
+# 出力は main() で作る（sounddevice は使う時点で読み込むため、main.py を import するだけなら PortAudio は不要）
+input_config, output_configs = load_audio_config(AUDIO_CONFIG_PATH, AUDIO_INPUT, AUDIO_OUTPUTS)
+audio_output = None
 
 # 実行
-asyncio.run(main())
+# （"process" ワーカーが main.py を読み込み直しても再実行されないようにする）
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 秒単位のレイテンシ用のバケット
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 実時間係数（RTF）用のバケット
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values, **labelvalues):
+        """ラベル値ごとの子メトリクスを返す（prometheus_client と同じ使い方）"""
+        if labelvalues:
+            values = tuple(str(labelvalues[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+            return child
+
+    def _default(self):
+        # ラベルなしのメトリクスは自分自身の唯一の子を操作する
+        return self.labels()
+
+    def samples(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set_function(self, function):
+        """値を読み出す時点で function() を評価する（他のオブジェクトが数えている累計値用。減らないこと）"""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+    def render(self):
+        return [f"{self.name}_total{_format_labels(self.labelnames, values)} {child.get()}"
+                for values, child in self.samples()]
+
+    def to_dict(self):
+        return {",".join(values) or "value": child.get() for values, child in self.samples()}
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """値を読み出す時点で function() を評価する（キューの長さなど）"""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def set_function(self, function):
+        self._default().set_function(function)
+
+    def render(self):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.get()}"
+                for values, child in self.samples()]
+
+    def to_dict(self):
+        return {",".join(values) or "value": child.get() for values, child in self.samples()}
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後は +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """バケット内を線形補間して分位点を推定する"""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return math.nan
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for i, bucket_count in enumerate(counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if cumulative + bucket_count >= rank and bucket_count > 0:
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = upper
+        return self.buckets[-1]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def render(self):
+        lines = []
+        for values, child in self.samples():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), child.counts):
+                cumulative += bucket_count
+                le = ("le", bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {child.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {child.count}")
+        return lines
+
+    def to_dict(self):
+        return {
+            ",".join(values) or "value": {
+                "count": child.count,
+                "sum": child.sum,
+                "p50": child.quantile(0.5),
+                "p90": child.quantile(0.9),
+                "p99": child.quantile(0.99),
+            }
+            for values, child in self.samples()
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式で出力する"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {
+            "timestamp": time.time(),
+            "metrics": {name: metric.to_dict() for name, metric in self.metrics.items()},
+        }
+
+    def serve(self, port, host="127.0.0.1"):
+        """localhost の /metrics で Prometheus 形式のメトリクスを公開する（デーモンスレッドで動作）"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+        print(f"Metrics available at http://{host}:{port}/metrics")
+        return server
+
+    def dump_json(self, path):
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(_json_dumps(self.to_dict()))
+
+    async def dump_json_periodically(self, path, interval):
+        """interval 秒ごとに JSON 形式でファイルへ書き出す"""
+        while True:
+            await asyncio.sleep(interval)
+            self.dump_json(path)
+
+
+def _json_dumps(data):
+    # NaN は JSON として不正なため null にする
+    def clean(value):
+        if isinstance(value, float) and math.isnan(value):
+            return None
+        if isinstance(value, dict):
+            return {key: clean(item) for key, item in value.items()}
+        return value
+
+    return json.dumps(clean(data), ensure_ascii=False, indent=2)
+
+
+# 既定のレジストリ（各モジュールはここにメトリクスを登録する）
+REGISTRY = MetricsRegistry()
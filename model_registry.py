@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ModelRegistry:
+    """モデルのロードをバックグラウンドスレッドで並行して行い、使う時点で完了を待つ
+
+    start() を呼ぶと登録済みの全モデルのロードを一斉に開始する。
+    start() を呼ばずに get() した場合は、そのモデルだけをその場でロードする（遅延ロード）。
+    ローダーの中から他のモデルを get() してもよい（各モデルは別スレッドでロードされる）。
+    warmup を指定した場合はロード後にウォームアップしてから利用可能にする。
+    warmup はモデルを受け取り、各回の所要時間のリスト（1回目がコールド）を返す。
+    lazy=True で登録したモデルは start() では読み込まず、必要になった時点で preload() / get() する。
+    """
+
+    def __init__(self):
+        self.loaders = {}
+        self.warmups = {}
+        self.lazy = set()
+        self.futures = {}
+        self.load_times = {}
+        self.warmup_times = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def register(self, name, loader, warmup=None, lazy=False):
+        self.loaders[name] = loader
+        if warmup is not None:
+            self.warmups[name] = warmup
+        if lazy:
+            self.lazy.add(name)
+
+    def start(self, names=None):
+        """指定したモデル（省略時は lazy でない全モデル）のロードを開始する"""
+        for name in names or [name for name in self.loaders if name not in self.lazy]:
+            self._submit(name)
+
+    def preload(self, name):
+        """待たずにバックグラウンドでロードを開始する"""
+        self._submit(name)
+
+    def _submit(self, name):
+        with self._lock:
+            if name not in self.futures:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max(1, len(self.loaders)), thread_name_prefix="model-loader"
+                    )
+                self.futures[name] = self._executor.submit(self._load, name)
+            return self.futures[name]
+
+    def _load(self, name):
+        start_time = time.perf_counter()
+        model = self.loaders[name]()
+        self.load_times[name] = time.perf_counter() - start_time
+        print(f"{name} loaded in {self.load_times[name]:.2f}s")
+        if name in self.warmups:
+            times = self.warmups[name](model)
+            self.warmup_times[name] = times
+            print(f"{name} warmed up: cold {times[0]:.2f}s, warm {times[-1]:.2f}s")
+        if name not in self.lazy and self._startup_loaded():
+            self.report()
+        return model
+
+    def get(self, name):
+        """モデルを返す（ロード中なら完了までブロックする）"""
+        return self._submit(name).result()
+
+    async def wait(self, name):
+        """イベントループを止めずにモデルのロード完了を待つ"""
+        return await asyncio.wrap_future(self._submit(name))
+
+    def _startup_loaded(self):
+        startup = [name for name in self.loaders if name not in self.lazy]
+        return all(name in self.load_times for name in startup) and all(
+            name in self.warmup_times for name in self.warmups if name not in self.lazy
+        )
+
+    def is_ready(self, name):
+        """ロードが完了していれば True（失敗した場合は False）"""
+        future = self.futures.get(name)
+        return future is not None and future.done() and future.exception() is None
+
+    def report(self):
+        breakdown = ", ".join(f"{name}: {load_time:.2f}s" for name, load_time in self.load_times.items())
+        print(f"Model load times [{breakdown}]")
+        if self.warmup_times:
+            warmup = ", ".join(
+                f"{name}: cold {times[0]:.2f}s / warm {times[-1]:.2f}s" for name, times in self.warmup_times.items()
+            )
+            print(f"Model warm-up times [{warmup}]")
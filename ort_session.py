@@ -0,0 +1,118 @@
+"""ONNX Runtime のセッション設定と、最適化済みモデルのキャッシュ
+
+Style-Bert-VITS2 は TTS・BERT の InferenceSession を内部で作るため、SessionOptions を渡す口がない。
+そこで onnxruntime.InferenceSession を差し替え、session_profile() の中で（同じスレッドから）
+作られたセッションにだけ設定を適用する。モデルのロードは別々のスレッドで並行して行われるため、
+設定はスレッドごとに保持する。
+
+cache_path を指定した場合、初回はグラフ最適化の結果をそのパスに保存し、
+次回以降は保存済みのモデルを最適化なしで読み込む（起動時の最適化を省く）。
+複数のプロセスが同時に保存しても壊れないよう、書き手ごとの一時ファイルに書いてから置き換える。
+最適化済みのモデルは ORT のバージョンや実行環境に依存するため、キーにバージョンを含めること。
+"""
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import onnxruntime
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+_local = threading.local()
+_OriginalInferenceSession = onnxruntime.InferenceSession
+
+
+def make_session_options(config, base=None):
+    """設定の辞書から SessionOptions を作る（None の項目は ORT の既定値のまま）
+
+    config の例: {"intra_op_num_threads": 4, "inter_op_num_threads": 1,
+                 "graph_optimization_level": "all", "enable_mem_pattern": True, "execution_mode": "sequential"}
+    """
+    options = onnxruntime.SessionOptions()
+    if base is not None:
+        options.log_severity_level = base.log_severity_level
+    for key, value in config.items():
+        if value is None:
+            continue
+        if key == "graph_optimization_level":
+            value = GRAPH_OPTIMIZATION_LEVELS[value]
+        elif key == "execution_mode":
+            value = EXECUTION_MODES[value]
+        setattr(options, key, value)
+    return options
+
+
+def cache_path(cache_dir, name, key, config):
+    """最適化済みモデルの保存先（キー・ORT のバージョン・最適化レベルごとに別ファイル）"""
+    if cache_dir is None:
+        return None
+    level = config.get("graph_optimization_level") or "all"
+    return Path(cache_dir) / f"{name}-{key}-ort{onnxruntime.__version__}-{level}.onnx"
+
+
+class ConfiguredInferenceSession(_OriginalInferenceSession):
+    """session_profile() で設定された SessionOptions・キャッシュを使う InferenceSession"""
+
+    def __init__(self, path_or_bytes, sess_options=None, providers=None, provider_options=None, **kwargs):
+        profile = getattr(_local, "profile", None)
+        if profile is None:
+            super().__init__(path_or_bytes, sess_options, providers, provider_options, **kwargs)
+            return
+
+        config, optimized_path = profile
+        sess_options = make_session_options(config, sess_options)
+        if optimized_path is not None and optimized_path.exists():
+            # 最適化済みのグラフを読み込むため、もう一度最適化しない
+            sess_options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS["disable"]
+            super().__init__(str(optimized_path), sess_options, providers, provider_options, **kwargs)
+            print(f"Optimized ONNX model loaded from {optimized_path}")
+            return
+
+        tmp_path = None
+        if optimized_path is not None and isinstance(path_or_bytes, (str, os.PathLike)):
+            optimized_path.parent.mkdir(parents=True, exist_ok=True)
+            # 同時にロードする別のプロセス・スレッドと衝突しないよう、一時ファイルの名前は書き手ごとに分ける
+            tmp_path = optimized_path.with_name(
+                f"{optimized_path.stem}.{os.getpid()}-{threading.get_ident()}.tmp{optimized_path.suffix}"
+            )
+            sess_options.optimized_model_filepath = str(tmp_path)
+        try:
+            super().__init__(path_or_bytes, sess_options, providers, provider_options, **kwargs)
+            if tmp_path is not None and tmp_path.exists():
+                try:
+                    os.replace(tmp_path, optimized_path)
+                    print(f"Optimized ONNX model saved to {optimized_path}")
+                except OSError as e:
+                    # 別のプロセスが先に保存して使用中の場合（Windows）は、そちらを次回から使う
+                    if not optimized_path.exists():
+                        print(f"Could not save the optimized ONNX model to {optimized_path}: {e}")
+        finally:
+            if tmp_path is not None:
+                tmp_path.unlink(missing_ok=True)
+
+
+def install():
+    """onnxruntime.InferenceSession を差し替える（何度呼んでもよい）"""
+    onnxruntime.InferenceSession = ConfiguredInferenceSession
+
+
+@contextmanager
+def session_profile(config, optimized_path=None):
+    """この中で作られる InferenceSession に config の設定と最適化済みモデルのキャッシュを適用する"""
+    install()
+    previous = getattr(_local, "profile", None)
+    _local.profile = (config, Path(optimized_path) if optimized_path is not None else None)
+    try:
+        yield
+    finally:
+        _local.profile = previous
@@ -0,0 +1,140 @@
+import asyncio
+import time
+import traceback
+
+from metrics import Counter, Gauge, Histogram
+
+STAGE_QUEUE_WAIT = Histogram("stage_queue_wait_seconds", "Time an item waited in the stage queue", ("stage",))
+STAGE_EXEC = Histogram("stage_exec_seconds", "Time the stage spent handling an item", ("stage",))
+STAGE_QUEUE_DEPTH = Gauge("stage_queue_depth", "Number of items waiting in the stage queue", ("stage",))
+SHED_ITEMS = Counter("shed_items", "Items dropped, merged or degraded to keep up with the input", ("stage", "reason"))
+
+
+class Stage:
+    """キューに作業が届いた瞬間に起きて処理するパイプラインステージ
+
+    trace_id を付けて投入した作業は、キューでの待ち時間と処理時間をスパンとして記録し、
+    ハンドラーにも trace_id キーワード引数として渡す。
+    maxsize を指定した場合、キューが一杯の間は put() が待たされる（上流への背圧）。
+    別スレッドからの put_threadsafe() は待てないため、一杯なら作業を捨てて記録する。
+    """
+
+    def __init__(self, name, handler, tracer=None, maxsize=0):
+        self.name = name
+        self.handler = handler
+        self.tracer = tracer
+        self.queue = asyncio.Queue(maxsize)
+        self.loop = None
+        self.task = None
+        self.current = None  # ハンドラーが処理中の作業
+        STAGE_QUEUE_DEPTH.labels(name).set_function(self.queue.qsize)
+
+    async def put(self, *item, trace_id=None):
+        """同じイベントループ上から作業を投入する"""
+        await self.queue.put((time.perf_counter(), trace_id, item))
+
+    def put_threadsafe(self, *item, trace_id=None):
+        """PortAudio のコールバックなど、別スレッドから作業を投入する"""
+        self.loop.call_soon_threadsafe(self._put_nowait, (time.perf_counter(), trace_id, item))
+
+    def _put_nowait(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            print(f"[{self.name}] queue is full. Item dropped.")
+            SHED_ITEMS.labels(self.name, "queue_full").inc()
+
+    def pending(self):
+        """キューに溜まっている作業を取り出さずに返す（古い順）"""
+        return [item for _, _, item in self.queue._queue]
+
+    def oldest(self):
+        """処理中の作業、なければキューの先頭の作業を返す（別スレッドから読んでもよい）"""
+        current = self.current
+        if current is not None:
+            return current
+        try:
+            return self.queue._queue[0][2]
+        except IndexError:
+            return None
+
+    def nearly_full(self):
+        """上限のあるキューが半分以上埋まっているか"""
+        return self.queue.maxsize > 0 and self.queue.qsize() >= self.queue.maxsize // 2
+
+    def discard(self, predicate):
+        """キューに溜まっている作業のうち predicate(trace_id, item) が真のものを取り除き、その数を返す"""
+        kept = []
+        removed = 0
+        while not self.queue.empty():
+            entry = self.queue.get_nowait()
+            self.queue.task_done()
+            if predicate(entry[1], entry[2]):
+                removed += 1
+            else:
+                kept.append(entry)
+        for entry in kept:
+            self.queue.put_nowait(entry)
+        return removed
+
+    async def take(self, limit, timeout=0.0):
+        """ハンドラーの中から、キューに溜まっている作業を最大 limit 件まとめて取り出す
+
+        キューが空になった場合は timeout 秒まで次の作業の到着を待つ。
+        (trace_id, item) のリストを返す。
+        """
+        taken = []
+        deadline = time.perf_counter() + timeout
+        while len(taken) < limit:
+            if self.queue.empty():
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                entry = self.queue.get_nowait()
+            # 取り出した作業は呼び出し元のハンドラーの処理に含まれる
+            self.queue.task_done()
+            enqueued_at, trace_id, item = entry
+            now = time.perf_counter()
+            STAGE_QUEUE_WAIT.labels(self.name).observe(now - enqueued_at)
+            if trace_id is not None and self.tracer is not None:
+                self.tracer.add_span(f"{self.name}.queue_wait", enqueued_at, now, trace_id, f"queue:{self.name}")
+            taken.append((trace_id, item))
+        return taken
+
+    def start(self):
+        """ステージの処理ループを開始する（別スレッドから投入される前に呼ぶこと）"""
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    async def run(self):
+        while True:
+            # ポーリングせず、作業が届くまでブロックする
+            enqueued_at, trace_id, item = await self.queue.get()
+            start_time = time.perf_counter()
+            wait_time = start_time - enqueued_at
+            self.current = item
+            try:
+                if trace_id is None:
+                    await self.handler(*item)
+                else:
+                    if self.tracer is not None:
+                        self.tracer.add_span(f"{self.name}.queue_wait", enqueued_at, start_time, trace_id, f"queue:{self.name}")
+                    await self.handler(*item, trace_id=trace_id)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.current = None
+                self.queue.task_done()
+
+            exec_time = time.perf_counter() - start_time
+            if trace_id is not None and self.tracer is not None:
+                self.tracer.add_span(f"{self.name}.exec", start_time, start_time + exec_time, trace_id, f"stage:{self.name}")
+            STAGE_QUEUE_WAIT.labels(self.name).observe(wait_time)
+            STAGE_EXEC.labels(self.name).observe(exec_time)
+            print(f"[{self.name}] queue wait: {wait_time:.3f}s, exec time: {exec_time:.3f}s")
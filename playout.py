@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from metrics import Gauge, Histogram
+
+PLAYOUT_LAG = Gauge("playout_lag_seconds", "Lag of the latest clip's playback behind the speech it voices")
+PLAYOUT_LAG_DISTRIBUTION = Histogram("playout_lag_distribution_seconds", "Lag of each segment's playback behind the speech it voices")
+
+
+class PlayoutScheduler:
+    """セグメントの発話時刻（perf_counter）を、再生開始の締め切りに変換する
+
+    各セグメントは「発話された時刻 + target_lag」に再生を始め、元の発話の「間」をそのまま保つ。
+    処理が遅れて締め切りを過ぎている場合は、前のクリップとの「間」を min_gap まで詰めて追いつく。
+    発話時刻のないクリップ（同じセグメントの2つ目以降のチャンクなど）は前のクリップに続けて再生する。
+    """
+
+    def __init__(self, target_lag=1.0, min_gap=0.1):
+        self.target_lag = target_lag
+        self.min_gap = min_gap
+        self.previous_source_end = None  # 前のセグメントが発話し終わった時刻
+        self.previous_end = 0.0  # 前のクリップの再生が終わった時刻
+
+    def schedule(self, source_start, source_end=None):
+        """再生を始める時刻を返す"""
+        now = time.perf_counter()
+        earliest = max(now, self.previous_end)
+        if source_start is None:
+            return earliest
+        if self.previous_source_end is not None:
+            # 遅れている場合でも、元の「間」が min_gap より短ければそのまま保つ
+            gap = max(source_start - self.previous_source_end, 0)
+            earliest = max(now, self.previous_end + min(gap, self.min_gap))
+        if source_end is not None:
+            self.previous_source_end = source_end
+        return max(source_start + self.target_lag, earliest)
+
+    async def wait(self, source_start=None, source_end=None):
+        """再生開始の時刻まで待ち、意図して待った時間を返す（再生し終えたら finished() を呼ぶこと）"""
+        start_time = time.perf_counter()
+        deadline = self.schedule(source_start, source_end)
+        await asyncio.sleep(max(deadline - time.perf_counter(), 0))
+        if source_start is not None:
+            lag = time.perf_counter() - source_start
+            PLAYOUT_LAG.set(lag)
+            PLAYOUT_LAG_DISTRIBUTION.observe(lag)
+            print(f"Playout lag: {lag:.2f}s (target {self.target_lag:.2f}s)")
+        return max(deadline - start_time, 0)
+
+    def finished(self):
+        self.previous_end = time.perf_counter()
+
+    def reset(self):
+        """再生を打ち切った場合に、前のクリップの情報を忘れる"""
+        self.previous_source_end = None
+        self.previous_end = 0.0
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+from metrics import Counter, Gauge
+
+QUALITY_DEGRADED = Gauge("quality_degraded", "1 while the pipeline runs with the cheaper STT / TTS settings")
+QUALITY_SWITCHES = Counter("quality_switches", "Switches between full-quality and cheaper settings", ("direction",))
+
+
+class QualityController:
+    """直近の RTF と待っている件数を見て、負荷が高い間は軽い設定に切り替える
+
+    rtf・depth は現在の値を返す関数。どちらかが上限（rtf_high / depth_high）を超えた状態が
+    hold 秒続くと degraded になり、両方が下限（rtf_low / depth_low）以下の状態が cooldown 秒
+    続くと元に戻る。上限を超えた時点で on_pressure を呼ぶため、軽いモデルのロードを
+    切り替えより先に始めておける。
+    """
+
+    def __init__(self, rtf, depth, rtf_high=0.8, rtf_low=0.5, depth_high=4, depth_low=0,
+                 hold=2.0, cooldown=10.0, on_pressure=None):
+        self.rtf = rtf
+        self.depth = depth
+        self.rtf_high = rtf_high
+        self.rtf_low = rtf_low
+        self.depth_high = depth_high
+        self.depth_low = depth_low
+        self.hold = hold
+        self.cooldown = cooldown
+        self.on_pressure = on_pressure
+        self.degraded = False
+        self._since = None  # 切り替えの条件を満たし始めた時刻
+
+    def update(self, now=None):
+        """現在の負荷で状態を更新し、切り替えた場合は True を返す"""
+        now = time.perf_counter() if now is None else now
+        rtf, depth = self.rtf(), self.depth()
+        if self.degraded:
+            switching = rtf <= self.rtf_low and depth <= self.depth_low
+        else:
+            switching = rtf > self.rtf_high or depth >= self.depth_high
+            if switching and self._since is None and self.on_pressure is not None:
+                self.on_pressure()
+        if not switching:
+            self._since = None
+            return False
+        if self._since is None:
+            self._since = now
+        if now - self._since < (self.cooldown if self.degraded else self.hold):
+            return False
+
+        self.degraded = not self.degraded
+        self._since = None
+        QUALITY_DEGRADED.set(int(self.degraded))
+        QUALITY_SWITCHES.labels("down" if self.degraded else "up").inc()
+        print(f"Quality {'lowered' if self.degraded else 'restored'} (RTF {rtf:.2f}, {depth} waiting)")
+        return True
+
+    async def run(self, interval=0.5):
+        while True:
+            self.update()
+            await asyncio.sleep(interval)
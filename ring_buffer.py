@@ -0,0 +1,61 @@
+import numpy as np
+
+
+class RingBuffer:
+    """単一プロデューサー・単一コンシューマー用の固定長リングバッファ
+
+    PortAudio のコールバック（プロデューサー）が事前確保した領域へ直接書き込み、
+    STT 側（コンシューマー）は累計サンプル位置で区間を指定してビューを受け取る。
+    各サンプルを本体とミラー領域の2箇所に書き込むため、容量以内の区間は
+    折り返しを含めて常にコピーなしの連続ビューとして取り出せる。
+    ロックは使わず、書き込み完了後に write_pos を更新することで区間を公開する。
+    """
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = capacity
+        self._data = np.zeros(capacity * 2, dtype=dtype)
+        # 累計書き込みサンプル数（プロデューサーのみが更新する）
+        self.write_pos = 0
+
+    def write(self, samples):
+        """サンプルを書き込む（プロデューサースレッドから呼ぶ）"""
+        pos = self.write_pos
+        n = len(samples)
+        if n > self.capacity:
+            # 容量を超える分は古い側を捨てる
+            pos += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+
+        offset = pos % self.capacity
+        first = min(n, self.capacity - offset)
+        rest = n - first
+        self._data[offset:offset + first] = samples[:first]
+        self._data[offset + self.capacity:offset + self.capacity + first] = samples[:first]
+        if rest:
+            self._data[:rest] = samples[first:]
+            self._data[self.capacity:self.capacity + rest] = samples[first:]
+
+        # 書き込み完了後に位置を公開する
+        self.write_pos = pos + n
+
+    def oldest_pos(self):
+        """まだ上書きされていない最も古いサンプル位置"""
+        return max(0, self.write_pos - self.capacity)
+
+    def is_valid(self, start):
+        """start 以降のサンプルがまだ上書きされていないか"""
+        return start >= self.oldest_pos()
+
+    def view(self, start, end):
+        """[start, end) の区間をコピーなしのビューとして返す
+
+        ビューはプロデューサーがさらに capacity サンプル書き込むまで有効。
+        それより長く保持する場合は呼び出し側でコピーすること。
+        """
+        if not start <= end <= self.write_pos:
+            raise ValueError(f"Invalid range: [{start}, {end}) (write_pos={self.write_pos})")
+        if not self.is_valid(start):
+            raise ValueError(f"Range [{start}, {end}) has already been overwritten")
+        offset = start % self.capacity
+        return self._data[offset:offset + (end - start)]
@@ -0,0 +1,131 @@
+import time
+from dataclasses import dataclass
+
+from metrics import Histogram
+
+# 発話途中の再デコード要求を表す種類（発話終了は vad.SPEECH_END を使う）
+PARTIAL = "partial"
+
+FIRST_TOKEN_LATENCY = Histogram("streaming_first_token_latency_seconds", "Time from the first word being spoken to it being decoded")
+COMMIT_LATENCY = Histogram("streaming_commit_latency_seconds", "Time from the last committed word being spoken to its commit")
+
+
+@dataclass
+class TimedWord:
+    start: int  # 累計サンプル位置
+    end: int
+    text: str
+
+
+class LocalAgreement:
+    """直近2回の仮説で一致した接頭辞だけを確定する（LocalAgreement-2 方式）"""
+
+    def __init__(self, tolerance, max_ngram=5):
+        self.tolerance = tolerance  # 確定済み区間と重なる単語を除外する際の許容サンプル数
+        self.max_ngram = max_ngram
+        self.previous = []  # 前回の仮説のうち未確定の単語
+        self.committed_tail = []  # 確定済みの末尾の単語（窓の境界での重複除去用）
+        self.committed_end = 0  # 確定済みの最後の単語の終了位置
+
+    def _new_words(self, words):
+        words = [word for word in words if word.end > self.committed_end + self.tolerance]
+        # 窓の先頭で確定済みの末尾の単語が再度出力された場合は取り除く
+        if words and words[0].start < self.committed_end + 20 * self.tolerance:
+            for n in range(min(self.max_ngram, len(words), len(self.committed_tail)), 0, -1):
+                if [word.text for word in words[:n]] == [word.text for word in self.committed_tail[-n:]]:
+                    return words[n:]
+        return words
+
+    def _commit(self, committed):
+        if committed:
+            self.committed_end = committed[-1].end
+            self.committed_tail = (self.committed_tail + committed)[-self.max_ngram:]
+        return committed
+
+    def update(self, words):
+        """新しい仮説を受け取り、今回確定した単語を返す"""
+        words = self._new_words(words)
+        committed = []
+        for word, previous_word in zip(words, self.previous):
+            if word.text != previous_word.text:
+                break
+            committed.append(word)
+        self.previous = words[len(committed):]
+        return self._commit(committed)
+
+    def finalize(self, words):
+        """発話終了時の最終仮説を受け取り、未確定の単語をすべて確定する"""
+        committed = self._new_words(words)
+        self.previous = []
+        return self._commit(committed)
+
+
+class StreamingTranscriber:
+    """発話中に伸びていく窓を再デコードし、安定した接頭辞を早期に確定する"""
+
+    def __init__(self, utterance_start, samplerate, min_window=0.5, prompt_length=100, whisper=None):
+        self.utterance_start = utterance_start
+        self.whisper = whisper  # この発話の再デコードに使うモデル・設定（発話の途中では切り替えない）
+        self.samplerate = samplerate
+        self.min_window_samples = int(min_window * samplerate)
+        self.prompt_length = prompt_length
+        self.agreement = LocalAgreement(tolerance=int(0.05 * samplerate))
+        self.window_start = utterance_start  # 再デコードする窓の開始位置（確定ごとに前へ進める）
+        self.committed_text = ""
+
+        # 計測値
+        self.first_token_latency = None
+        self.commit_latencies = []
+
+    def prompt(self):
+        """確定済みの文字列の末尾を次のデコードの文脈として渡す"""
+        return self.committed_text[-self.prompt_length:] or None
+
+    def should_decode(self, end):
+        return end - self.window_start >= self.min_window_samples
+
+    def words_from_segments(self, segments, window_start):
+        """Whisperのセグメント（窓内の秒単位）をサンプル位置付きの単語に変換する"""
+        words = []
+        for segment in segments:
+            for word in segment.words or []:
+                text = word.word.strip()
+                if text:
+                    words.append(TimedWord(
+                        start=window_start + int(word.start * self.samplerate),
+                        end=window_start + int(word.end * self.samplerate),
+                        text=text,
+                    ))
+        return words
+
+    def update(self, segments, window_start, capture_time, final=False):
+        """デコード結果を反映し、今回確定した単語を返す
+
+        capture_time はサンプル位置をその音声が録音された時刻（perf_counter）に変換する関数。
+        """
+        now = time.perf_counter()
+        words = self.words_from_segments(segments, window_start)
+        if words and self.first_token_latency is None:
+            self.first_token_latency = now - capture_time(words[0].start)
+            FIRST_TOKEN_LATENCY.observe(self.first_token_latency)
+
+        if final:
+            committed = self.agreement.finalize(words)
+        else:
+            committed = self.agreement.update(words)
+        if committed:
+            self.commit_latencies.append(now - capture_time(committed[-1].end))
+            COMMIT_LATENCY.observe(self.commit_latencies[-1])
+            self.committed_text += "".join(word.text for word in committed)
+            # 確定済みの区間は窓から外し、次回以降のデコード量を減らす
+            self.window_start = max(self.window_start, self.agreement.committed_end)
+        return committed
+
+    def report(self):
+        if self.first_token_latency is None:
+            return
+        commit = ""
+        if self.commit_latencies:
+            commit = ", commit latency avg: %.2fs, max: %.2fs" % (
+                sum(self.commit_latencies) / len(self.commit_latencies), max(self.commit_latencies))
+        print("Streaming STT first token latency: %.2fs%s" % (self.first_token_latency, commit))
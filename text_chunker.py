@@ -0,0 +1,32 @@
+# 文の区切りとなる句読点（常にここで区切る）
+SENTENCE_DELIMITERS = "。！？!?"
+# 節の区切りとなる句読点（チャンクが短すぎる場合は区切らない）
+CLAUSE_DELIMITERS = "、，,"
+# 閉じ括弧などは直前の句読点と同じチャンクに含める
+TRAILING_CHARS = "」』）)】〕’”…ー〜"
+
+
+def split_text(text, min_clause_length=10):
+    """日本語の文・節の句読点でテキストを合成用のチャンクに分割する
+
+    「、」での分割は、チャンクが min_clause_length 文字以上になる場合に限る。
+    短すぎるチャンクは韻律が不自然になり、推論回数も増えるため。
+    """
+    chunks = []
+    current = ""
+    i = 0
+    while i < len(text):
+        char = text[i]
+        current += char
+        i += 1
+        if char in SENTENCE_DELIMITERS or (char in CLAUSE_DELIMITERS and len(current) >= min_clause_length):
+            # 連続する句読点や閉じ括弧はまとめて同じチャンクに含める
+            while i < len(text) and (text[i] in SENTENCE_DELIMITERS or text[i] in TRAILING_CHARS):
+                current += text[i]
+                i += 1
+            if current.strip():
+                chunks.append(current.strip())
+            current = ""
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
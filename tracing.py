@@ -0,0 +1,152 @@
+import cProfile
+import functools
+import importlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Tracer:
+    """発話ごとのトレース ID 付きでスパンを記録し、Chrome / Perfetto 形式の JSON に書き出す
+
+    スパンは track（"stt", "tts", "playback" など）ごとに別の行として表示される。
+    track を省略した場合は記録したスレッドの行になる。
+    スパンは書き出すまでメモリに保持し、max_events を超えると古いものから捨てる（1件あたり約0.5KB）。
+    """
+
+    def __init__(self, enabled=True, max_events=100_000):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)
+        self.pid = os.getpid()
+        self._trace_ids = itertools.count(1)
+        self._tracks = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def new_trace_id(self):
+        return next(self._trace_ids)
+
+    @contextmanager
+    def context(self, trace_id):
+        """このスレッドで実行中の処理のトレース ID を設定する（ライブラリ内部のスパン用）"""
+        previous = getattr(self._local, "trace_id", None)
+        self._local.trace_id = trace_id
+        try:
+            yield
+        finally:
+            self._local.trace_id = previous
+
+    def current_trace_id(self):
+        return getattr(self._local, "trace_id", None)
+
+    def last_span_end(self, name):
+        """このスレッドで最後に記録した name のスパンの終了時刻（なければ None）"""
+        return getattr(self._local, "last_end", {}).get(name)
+
+    def _tid(self, track):
+        if track is None:
+            track = threading.current_thread().name
+        with self._lock:
+            if track not in self._tracks:
+                self._tracks[track] = len(self._tracks) + 1
+            return self._tracks[track]
+
+    def add_span(self, name, start, end, trace_id=None, track=None, **args):
+        """perf_counter で計測した start〜end のスパンを記録する"""
+        if not self.enabled:
+            return
+        if not hasattr(self._local, "last_end"):
+            self._local.last_end = {}
+        self._local.last_end[name] = end
+        if trace_id is not None:
+            args["trace_id"] = trace_id
+        self.events.append({
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": max(end - start, 0) * 1e6,
+            "pid": self.pid,
+            "tid": self._tid(track),
+            "args": args,
+        })
+
+    @contextmanager
+    def span(self, name, trace_id=None, track=None, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.perf_counter(), trace_id, track, **args)
+
+    def export(self, path):
+        """Chrome の chrome://tracing や Perfetto UI で開ける JSON を書き出す"""
+        with self._lock:
+            tracks = dict(self._tracks)
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": track}}
+            for track, tid in tracks.items()
+        ]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": metadata + list(self.events), "displayTimeUnit": "ms"}, file, ensure_ascii=False)
+        print(f"Trace written to {path} ({len(self.events)} spans)")
+
+
+def instrument_bert(tracer, track="tts"):
+    """Style-Bert-VITS2 の BERT 特徴量抽出をラップし、合成中の BERT 部分をスパンとして記録する
+
+    ライブラリのバージョンによって関数の場所が異なるため、見つかったものだけをラップする。
+    ラップできた場合は True を返す。
+    """
+    candidates = [
+        ("style_bert_vits2.models.infer_onnx", "extract_bert_feature_onnx"),
+        ("style_bert_vits2.models.infer", "extract_bert_feature"),
+    ]
+    instrumented = False
+    for module_name, attr in candidates:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        func = getattr(module, attr, None)
+        if func is None or getattr(func, "__traced__", False):
+            continue
+
+        @functools.wraps(func)
+        def traced(*args, __func=func, **kwargs):
+            with tracer.span("tts.bert_features", tracer.current_trace_id(), track):
+                return __func(*args, **kwargs)
+
+        traced.__traced__ = True
+        setattr(module, attr, traced)
+        instrumented = True
+    return instrumented
+
+
+class StageProfiler:
+    """指定したステージのワーカー処理だけを cProfile で計測する（スレッドワーカー用）"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self._lock = threading.Lock()
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def profiled(*args, **kwargs):
+            # cProfile はスレッドごとに有効化されるため、ワーカースレッド上で有効化する
+            with self._lock:
+                self.profile.enable()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.profile.disable()
+
+        return profiled
+
+    def dump(self, path):
+        self.profile.dump_stats(path)
+        print(f"Profile written to {path}")
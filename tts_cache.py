@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+
+def normalize_text(text):
+    """表記揺れでキャッシュが外れないよう、テキストを正規化する"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class TTSCache:
+    """合成済み音声のキャッシュ
+
+    キーは（正規化したテキスト, モデル UUID, スタイル, 合成パラメータ）のハッシュ。
+    メモリ上ではバイト数を上限とした LRU で保持し、disk_dir を指定した場合は
+    再起動後も使えるようディスクにも保存する（disk_max_bytes を上限に、最終利用の古いものから消す）。
+    ディスクへの書き込みと get_async() での読み込みは、呼び出し元（イベントループなど）を止めないよう別スレッドで行う。
+    ディスクのファイルは使うたびに更新時刻を更新し、再起動後もその順で古いものから消す。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None, disk_max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.entries = OrderedDict()  # key -> (sr, audio)
+        self.bytes = 0
+        self.disk_entries = OrderedDict()  # key -> ファイルサイズ（最終利用が古い順）
+        self.disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        self._writer = None
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-cache-writer")
+            for path in sorted(self.disk_dir.glob("*.npz"), key=lambda path: path.stat().st_mtime):
+                if ".tmp" in path.name:
+                    continue
+                self.disk_entries[path.stem] = path.stat().st_size
+                self.disk_bytes += path.stat().st_size
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text, model_uuid, style, params):
+        payload = json.dumps(
+            [normalize_text(text), str(model_uuid), style, params],
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key):
+        return self.disk_dir / f"{key}.npz"
+
+    def get(self, key):
+        """キャッシュされた (sr, audio) を返す。なければ None（ディスクから読む間は呼び出し元をブロックする）"""
+        entry = self._memory_get(key)
+        if entry is not None:
+            return entry
+        return self._from_disk(key, self._disk_get(key) if self.disk_dir else None)
+
+    async def get_async(self, key):
+        """get() と同じだが、ディスクからの読み込みは書き込みスレッドで行い、イベントループを止めない"""
+        entry = self._memory_get(key)
+        if entry is not None:
+            return entry
+        if self._writer is None:
+            return self._from_disk(key, None)
+        loop = asyncio.get_running_loop()
+        return self._from_disk(key, await loop.run_in_executor(self._writer, self._disk_get, key))
+
+    def _memory_get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+        return entry
+
+    def _disk_get(self, key):
+        """ディスクから読み込み、最終利用として更新時刻を更新する（なければ None）"""
+        path = self._disk_path(key)
+        try:
+            with np.load(path) as data:
+                entry = (int(data["sr"]), data["audio"])
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            return None
+        with self._disk_lock:
+            if key in self.disk_entries:
+                self.disk_entries.move_to_end(key)
+        return entry
+
+    def _from_disk(self, key, entry):
+        """ディスクから読んだ結果をメモリに載せて返す（呼び出し元のスレッドで実行）"""
+        if entry is None:
+            self.misses += 1
+            return None
+        self._store(key, entry)
+        self.disk_hits += 1
+        return entry
+
+    def put(self, key, sr, audio):
+        entry = (sr, audio)
+        self._store(key, entry)
+        if self._writer is not None and audio.nbytes <= self.disk_max_bytes:
+            self._writer.submit(self._write, key, sr, audio)
+
+    def _write(self, key, sr, audio):
+        """ディスクに保存し、上限を超えた分を最終利用の古いものから消す（書き込みスレッドで実行）"""
+        path = self._disk_path(key)
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        # （同じディレクトリを複数のプロセスで共有しても衝突しないよう、一時ファイルの名前は書き手ごとに分ける）
+        tmp_path = path.with_name(f"{key}.{os.getpid()}-{threading.get_ident()}.tmp.npz")
+        np.savez(tmp_path, sr=sr, audio=audio)
+        os.replace(tmp_path, path)
+        size = path.stat().st_size
+        with self._disk_lock:
+            self.disk_bytes += size - self.disk_entries.pop(key, 0)
+            self.disk_entries[key] = size
+            evicted = []
+            while self.disk_bytes > self.disk_max_bytes and len(self.disk_entries) > 1:
+                old_key, old_size = self.disk_entries.popitem(last=False)
+                self.disk_bytes -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                self._disk_path(old_key).unlink()
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """書き込み待ちの音声をディスクに保存し終えるまで待つ"""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+
+    def _store(self, key, entry):
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1].nbytes
+        size = entry[1].nbytes
+        if size > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.bytes += size
+        # 上限を超えた分は最も長く使われていないものから捨てる
+        while self.bytes > self.max_bytes:
+            _, (_, audio) = self.entries.popitem(last=False)
+            self.bytes -= audio.nbytes
+
+    def stats(self):
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "disk_bytes": self.disk_bytes,
+        }
+
+    def report(self):
+        print("TTS cache: %d hits (%d from disk), %d misses, %d entries, %.1f MB" % (
+            self.memory_hits + self.disk_hits, self.disk_hits, self.misses,
+            len(self.entries), self.bytes / (1024 * 1024)))
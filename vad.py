@@ -0,0 +1,102 @@
+import numpy as np
+
+# VadSegmenter.process が返すイベントの種類
+SPEECH_START = "start"
+SPEECH_END = "end"
+
+
+class VadSegmenter:
+    """フレーム単位のエネルギーベース音声区間検出
+
+    - 環境ノイズに追従するノイズフロアを推定し、閾値をその上に置く
+    - 有声フレームが onset_duration 続いた時点で発話開始とする（クリック音などを無視する）
+    - 発話開始位置は pre_roll 分さかのぼり、語頭の取りこぼしを防ぐ
+    - 無音が end_of_speech 続いたら発話終了とする（ハングオーバー）
+    - 発話終了位置は最後の有声フレームの post_roll 後までに切り詰め、末尾の無音を STT に渡さない
+    - max_duration で強制的に区切った直後（end_of_speech 以内）に続く発話は continuation とし、
+      区切った位置から pre-roll なしで始める（境界の音声を二重に STT に渡さない）
+
+    位置はすべて呼び出し側が管理する累計サンプル位置（リングバッファの write_pos）で扱う。
+    """
+
+    def __init__(
+        self,
+        samplerate,
+        threshold=0.01,
+        noise_ratio=3.0,
+        onset_duration=0.05,
+        end_of_speech=0.5,
+        pre_roll=0.3,
+        post_roll=0.15,
+        max_duration=30.0,
+    ):
+        self.samplerate = samplerate
+        self.threshold = threshold  # 有声とみなす最小 RMS
+        self.noise_ratio = noise_ratio  # ノイズフロアに対する閾値の倍率
+        self.onset_samples = int(onset_duration * samplerate)
+        self.end_of_speech_samples = int(end_of_speech * samplerate)
+        self.pre_roll_samples = int(pre_roll * samplerate)
+        self.post_roll_samples = int(post_roll * samplerate)
+        self.max_samples = int(max_duration * samplerate)
+
+        self.noise_floor = threshold / noise_ratio
+        self.in_speech = False
+        self.candidate_start = None  # 発話開始候補の位置
+        self.speech_start = 0  # 発話開始位置（pre-roll 込み）
+        self.last_voiced_end = 0  # 最後の有声フレームの終了位置
+        self.split_end = None  # max_duration で強制的に区切った位置
+        self.continuation = False  # 現在の発話が強制的に区切った発話の続きか
+
+    def current_threshold(self):
+        return max(self.threshold, self.noise_floor * self.noise_ratio)
+
+    def is_voiced(self, frame):
+        rms = float(np.sqrt(np.mean(np.square(frame)))) if len(frame) else 0.0
+        voiced = rms >= self.current_threshold()
+        if not voiced and not self.in_speech:
+            # ノイズフロアは非発話区間でのみ更新する（下がる時は速く、上がる時は遅く追従）
+            rate = 0.2 if rms < self.noise_floor else 0.02
+            self.noise_floor += (rms - self.noise_floor) * rate
+        return voiced
+
+    def process(self, frame, frame_start):
+        """1フレーム分の音声を判定し、発話の開始・終了を検出したらイベントを返す
+
+        Returns:
+            None または (SPEECH_START, 開始位置, None) / (SPEECH_END, 開始位置, 終了位置)
+        """
+        frame_end = frame_start + len(frame)
+        voiced = self.is_voiced(frame)
+
+        if not self.in_speech:
+            if not voiced:
+                self.candidate_start = None
+                return None
+            if self.candidate_start is None:
+                self.candidate_start = frame_start
+            if frame_end - self.candidate_start < self.onset_samples:
+                return None
+            self.in_speech = True
+            self.continuation = (
+                self.split_end is not None and self.candidate_start - self.split_end < self.end_of_speech_samples
+            )
+            if self.continuation:
+                self.speech_start = self.split_end
+            else:
+                self.speech_start = max(0, self.candidate_start - self.pre_roll_samples)
+            self.split_end = None
+            self.last_voiced_end = frame_end
+            self.candidate_start = None
+            return (SPEECH_START, self.speech_start, None)
+
+        if voiced:
+            self.last_voiced_end = frame_end
+        silence_samples = frame_end - self.last_voiced_end
+        if silence_samples < self.end_of_speech_samples and frame_end - self.speech_start < self.max_samples:
+            return None
+
+        # 末尾の無音を切り詰めて発話区間を確定する
+        self.in_speech = False
+        speech_end = min(frame_end, self.last_voiced_end + self.post_roll_samples)
+        self.split_end = speech_end if silence_samples < self.end_of_speech_samples else None
+        return (SPEECH_END, self.speech_start, speech_end)
@@ -0,0 +1,45 @@
+import time
+
+import numpy as np
+
+# 合成のウォームアップに使う文（句読点・かな・漢字を含め、pyopenjtalk と BERT の一通りの経路を通す）
+WARMUP_TEXT = "こんにちは、音声合成のウォームアップです。"
+
+
+def time_runs(func, runs=2):
+    """func を runs 回実行し、各回の所要時間を返す（1回目がコールド、以降がウォーム）"""
+    times = []
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+    return times
+
+
+def dummy_speech(samplerate, duration=2.0, seed=0):
+    """音声に近いスペクトルを持つダミー音声（倍音 + ビブラート + 弱いノイズ）を生成する"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(samplerate * duration)) / samplerate
+    f0 = 140 + 20 * np.sin(2 * np.pi * 3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / samplerate
+    audio = sum(np.sin(k * phase) / k for k in range(1, 8))
+    # 音節のような抑揚をつける
+    audio *= 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    audio = 0.1 * audio / np.max(np.abs(audio)) + rng.normal(0, 0.003, len(t))
+    return audio.astype(np.float32)
+
+
+def warmup_whisper(whisper_model, samplerate=16000, **options):
+    """ダミー音声で文字起こしを実行し、CTranslate2 の遅延初期化などを済ませる"""
+    audio = dummy_speech(samplerate)
+
+    def run():
+        segments, _ = whisper_model.transcribe(audio, language="ja", **options)
+        list(segments)
+
+    return time_runs(run)
+
+
+def warmup_tts(tts_model, style, params, text=WARMUP_TEXT):
+    """ダミーの文で音声合成を実行し、辞書のロードや ONNX セッションの初回実行を済ませる"""
+    return time_runs(lambda: tts_model.infer(text=text, style=style, **params))
@@ -0,0 +1,193 @@
+"""Whisper のデコード設定の自動調整
+
+短い校正用コーパスを compute_type・ビーム幅・温度フォールバックの
+組み合わせで文字起こしし、各設定のデコード時間（RTF）と参照の文字起こしとの一致率を計測する。
+一致率が基準を満たし、発話ごとのデコード時間が目標以内の設定のうち最も速いものを保存する。
+main.py は起動時に保存された設定（WHISPER_CONFIG_PATH）を読み込んで使う。
+セグメントのタイムスタンプは再生のスケジュールや batch_transcode の配置に使うため、
+without_timestamps は調整の対象にしない。
+
+    python whisper_autotune.py calibration/ --target-latency 1.0
+
+参照の文字起こしは、各 WAV ファイルと同じ名前の .txt があればそれを使い、
+なければ最も精度の高い設定（float32・ビーム幅5・温度フォールバックあり）の結果を使う。
+"""
+import argparse
+import json
+import re
+import time
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+
+COMPUTE_TYPES = ("int8", "int8_float32", "float32")
+BEAM_SIZES = (1, 5)
+TEMPERATURES = {
+    "fallback": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],  # faster-whisper の既定値
+    "greedy": [0.0],
+}
+REFERENCE_SETTING = ("float32", 5, "fallback")
+
+# 一致率の計算で無視する文字（空白・句読点）
+IGNORED_CHARACTERS = re.compile(r"[\s、。，．,.!?！？「」『』・…ー〜~]")
+
+
+def load_whisper_config(path, model):
+    """保存された設定を (compute_type, transcribe のオプション) で返す（なければ既定値）"""
+    if path is None or not Path(path).exists():
+        return "default", {}
+    config = json.loads(Path(path).read_text(encoding="utf-8"))
+    if config["model"] != model:
+        print(f"Ignoring {path}: tuned for Whisper {config['model']}, not {model}")
+        return "default", {}
+    print(f"Whisper decode settings loaded from {path}: {config['compute_type']}, {config['transcribe_options']}")
+    return config["compute_type"], config["transcribe_options"]
+
+
+def read_reference(paths, name):
+    """WAV ファイルと同じ名前の .txt があれば参照の文字起こしとして返す"""
+    for path in map(Path, paths):
+        file = path / name if path.is_dir() else path
+        if file.name == name and file.with_suffix(".txt").exists():
+            return file.with_suffix(".txt").read_text(encoding="utf-8").strip()
+    return None
+
+
+def transcribe_options(beam_size, temperature):
+    return {
+        "beam_size": beam_size,
+        "temperature": TEMPERATURES[temperature],
+    }
+
+
+def character_error_rate(reference, hypothesis):
+    """空白・句読点を除いた文字単位の編集距離を、参照の文字数で割った値"""
+    reference = IGNORED_CHARACTERS.sub("", reference)
+    hypothesis = IGNORED_CHARACTERS.sub("", hypothesis)
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    previous = list(range(len(hypothesis) + 1))
+    for i, r in enumerate(reference, 1):
+        current = [i]
+        for j, h in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / len(reference)
+
+
+def agreement(references, hypotheses):
+    """参照との一致率（1 - 全体の文字誤り率。参照の文字数で重み付け）"""
+    lengths = [max(len(IGNORED_CHARACTERS.sub("", reference)), 1) for reference in references]
+    errors = sum(
+        character_error_rate(reference, hypothesis) * length
+        for reference, hypothesis, length in zip(references, hypotheses, lengths)
+    )
+    return max(1.0 - errors / sum(lengths), 0.0)
+
+
+def decode_corpus(whisper_model, corpus, options):
+    """コーパスを1件ずつ文字起こしし、(文字起こしのリスト, デコード時間のリスト) を返す"""
+    texts = []
+    times = []
+    for _, audio in corpus:
+        start_time = time.perf_counter()
+        segments, _ = whisper_model.transcribe(audio, language="ja", **options)
+        texts.append("".join(segment.text for segment in segments))
+        times.append(time.perf_counter() - start_time)
+    return texts, times
+
+
+def choose(results, target_latency, min_agreement):
+    """基準を満たす設定のうち最も速いものを返す（なければ一致率の基準だけを満たす最速の設定）"""
+    accurate = [result for result in results if result["agreement"] >= min_agreement]
+    within_target = [result for result in accurate if result["latency_p90"] <= target_latency]
+    if within_target:
+        return min(within_target, key=lambda result: (result["rtf"], -result["agreement"])), True
+    if accurate:
+        return min(accurate, key=lambda result: (result["rtf"], -result["agreement"])), False
+    return max(results, key=lambda result: result["agreement"]), False
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Find the fastest Whisper decode settings that meet a latency target")
+    parser.add_argument("corpus", nargs="+", help="calibration WAV files or directories (optional .txt references alongside)")
+    parser.add_argument("--target-latency", type=float, default=1.0, help="p90 decode time per utterance to meet (seconds)")
+    parser.add_argument("--min-agreement", type=float, default=0.9, help="minimum character agreement with the reference")
+    parser.add_argument("--compute-types", nargs="+", default=COMPUTE_TYPES, help="compute types to try")
+    parser.add_argument("--output", help="where to save the chosen settings (default: main.WHISPER_CONFIG_PATH)")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    # main.py は読み込み時にモデルの設定などを行うため、ここで読み込む
+    import main
+    from benchmark import load_corpus
+    from faster_whisper import WhisperModel
+    from warmup import warmup_whisper
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        raise SystemExit("No calibration audio found.")
+    audio_duration = sum(len(audio) for _, audio in corpus) / main.STT_SAMPLERATE
+    references = [read_reference(args.corpus, name) for name, _ in corpus]
+    print(f"Calibration corpus: {len(corpus)} files, {audio_duration:.1f}s of audio, "
+          f"{sum(reference is not None for reference in references)} with reference transcripts")
+
+    results = []
+    compute_types = sorted(args.compute_types, key=lambda compute_type: compute_type != REFERENCE_SETTING[0])
+    for compute_type in compute_types:
+        whisper_model = WhisperModel(
+            main.WHISPER_MODEL, download_root=main.custom_cache_dir,
+            compute_type=compute_type, cpu_threads=main.cpu_budget.threads("stt"),
+        )
+        warmup_whisper(whisper_model, main.STT_SAMPLERATE)
+        settings = product(BEAM_SIZES, TEMPERATURES)
+        # 参照に使う設定を最初に実行する
+        settings = sorted(settings, key=lambda setting: (compute_type, *setting) != REFERENCE_SETTING)
+        for beam_size, temperature in settings:
+            options = transcribe_options(beam_size, temperature)
+            texts, times = decode_corpus(whisper_model, corpus, options)
+            if (compute_type, beam_size, temperature) == REFERENCE_SETTING:
+                references = [reference if reference is not None else text for reference, text in zip(references, texts)]
+            result = {
+                "compute_type": compute_type,
+                "transcribe_options": options,
+                "rtf": sum(times) / audio_duration,
+                "latency_p50": float(np.percentile(times, 50)),
+                "latency_p90": float(np.percentile(times, 90)),
+                "agreement": agreement(references, texts) if None not in references else None,
+            }
+            results.append(result)
+            print(f"{compute_type:<13} beam={beam_size} "
+                  f"temperature={temperature:<8} RTF {result['rtf']:.3f}, p90 {result['latency_p90']:.2f}s, "
+                  f"agreement {result['agreement'] if result['agreement'] is not None else float('nan'):.3f}")
+        del whisper_model
+
+    results = [result for result in results if result["agreement"] is not None]
+    if not results:
+        raise SystemExit(f"No reference transcripts: include {REFERENCE_SETTING[0]} in --compute-types or add .txt files.")
+    best, meets_target = choose(results, args.target_latency, args.min_agreement)
+    if not meets_target:
+        print(f"No setting met p90 <= {args.target_latency:.2f}s with agreement >= {args.min_agreement:.2f}; "
+              "saving the closest one.")
+    config = {
+        "model": main.WHISPER_MODEL,
+        "compute_type": best["compute_type"],
+        "transcribe_options": best["transcribe_options"],
+        "target_latency": args.target_latency,
+        "min_agreement": args.min_agreement,
+        "meets_target": meets_target,
+        "measured": {key: best[key] for key in ("rtf", "latency_p50", "latency_p90", "agreement")},
+        "results": results,
+    }
+    output = Path(args.output or main.WHISPER_CONFIG_PATH)
+    output.write_text(json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Chosen: {best['compute_type']} {best['transcribe_options']} "
+          f"(RTF {best['rtf']:.3f}, p90 {best['latency_p90']:.2f}s, agreement {best['agreement']:.3f})")
+    print(f"Whisper decode settings written to {output}")
+
+
+if __name__ == "__main__":
+    run()